@@ -5,7 +5,8 @@ gathered to remove reference cycles.
 
 """
 
-__all__ = ['refbrowser',
+__all__ = ['httpbrowser',
+           'refbrowser',
            'refbrowser_gui',
            'tracker',
            'summary']
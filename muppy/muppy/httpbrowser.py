@@ -0,0 +1,525 @@
+"""Heap browsing through a local HTTP server.
+
+This module allows to browse a snapshot of all objects with a web browser,
+e.g. on machines where Tk is not available. The HeapBrowser captures a
+snapshot, indexes the references between the objects, and serves the data as
+paged JSON from a server bound to localhost. A minimal HTML front end is
+served at the root URL.
+
+The following URLs are available. Lists are paged with the offset and limit
+parameters, objects are identified by their id.
+
+=========================  ==================================================
+/api/summary               a summary of the snapshot, largest types first
+/api/objects?type=T        objects of the type with the representation T
+/api/object?id=N           a single object
+/api/referrers?id=N        objects which refer to an object
+/api/referents?id=N        objects an object refers to
+/api/path?id=N             a path of references from a root to an object
+=========================  ==================================================
+
+Note that the snapshot keeps all objects alive until the HeapBrowser is
+released.
+
+"""
+import array
+import BaseHTTPServer
+import cgi
+import gc
+import sys
+import threading
+import urlparse
+
+import muppy
+import refbrowser
+import summary
+from muppy import _getsizeof
+
+class _Snapshot(object):
+    """Snapshot of all objects and the references between them.
+
+    Objects are identified by their position in the snapshot. References
+    are stored in both directions as packed arrays: the referents of the
+    object at position i are targets[offsets[i]:offsets[i+1]], the same
+    applies to referrers. Thus, any page of referents or referrers can be
+    looked up in time proportional to its size.
+
+    A path from a root to each object is recorded with parent positions,
+    found by a breadth-first search starting at the roots.
+
+    """
+    def __init__(self, roots=None):
+        """Capture a snapshot.
+
+        keyword arguments
+        roots -- objects from which paths are searched, per default
+                 sys.modules
+        """
+        if roots is None:
+            roots = [sys.modules]
+        ignore = set([id(self), id(self.__dict__)])
+        self.objects = muppy._get_snapshot(ignore, [globals()])
+        self._positions = {}
+        for i in xrange(len(self.objects)):
+            self._positions[id(self.objects[i])] = i
+        # referents of all objects, including those which are added while
+        # iterating
+        self._referent_offsets = array.array('l', [0])
+        self._referents = array.array('l')
+        i = 0
+        while i < len(self.objects):
+            for ref in gc.get_referents(self.objects[i]):
+                if id(ref) in ignore:
+                    continue
+                self._referents.append(self._add(ref))
+            self._referent_offsets.append(len(self._referents))
+            i += 1
+        self._index_referrers()
+        self._index_types()
+        self._index_paths(roots)
+
+    def _add(self, o):
+        """Add an object unless already included and return its position."""
+        position = self._positions.get(id(o))
+        if position is None:
+            position = self._positions[id(o)] = len(self.objects)
+            self.objects.append(o)
+        return position
+
+    def _index_referrers(self):
+        """Invert the referents into referrers."""
+        n = len(self.objects)
+        counts = array.array('l', [0]) * (n + 1)
+        for target in self._referents:
+            counts[target + 1] += 1
+        for i in xrange(n):
+            counts[i + 1] += counts[i]
+        self._referrer_offsets = counts
+        self._referrers = array.array('l', [0]) * len(self._referents)
+        filled = array.array('l', counts)
+        for source in xrange(n):
+            for j in xrange(self._referent_offsets[source],\
+                            self._referent_offsets[source + 1]):
+                target = self._referents[j]
+                self._referrers[filled[target]] = source
+                filled[target] += 1
+
+    def _index_types(self):
+        """Compute the size of all objects and group them by type."""
+        self.sizes = array.array('l')
+        # positions of all objects of each type representation
+        self._types = {}
+        labels = {}
+        for o in self.objects:
+            t = type(o)
+            label = labels.get(t)
+            if label is None:
+                label = labels[t] = summary._repr_type(t)
+                self._types.setdefault(label, array.array('l'))
+            self._types[label].append(len(self.sizes))
+            self.sizes.append(_getsizeof(o))
+        rows = []
+        for (label, positions) in self._types.iteritems():
+            size = 0
+            for position in positions:
+                size += self.sizes[position]
+            rows.append([label, len(positions), size])
+        rows.sort(lambda r1, r2: cmp(r2[2], r1[2]))
+        self.summary = rows
+
+    def _index_paths(self, roots):
+        """Record the parent of each object reachable from the roots."""
+        # -1 for unreachable objects, roots are their own parents
+        self._parents = array.array('l', [-1]) * len(self.objects)
+        level = []
+        for root in roots:
+            position = self._positions.get(id(root))
+            if (position is not None) and (self._parents[position] == -1):
+                self._parents[position] = position
+                level.append(position)
+        while level:
+            next_level = []
+            for source in level:
+                for j in xrange(self._referent_offsets[source],\
+                                self._referent_offsets[source + 1]):
+                    target = self._referents[j]
+                    if self._parents[target] == -1:
+                        self._parents[target] = source
+                        next_level.append(target)
+            level = next_level
+
+    def __len__(self):
+        return len(self.objects)
+
+    def get_position(self, _id):
+        """Get the position of the object with the given id or None."""
+        return self._positions.get(_id)
+
+    def get_objects(self, label, offset, limit):
+        """Get a page of the positions of objects of a type representation,
+        as well as the total number of such objects."""
+        positions = self._types.get(label, ())
+        return (positions[offset:offset + limit], len(positions))
+
+    def get_referents(self, position, offset, limit):
+        """Get a page of the positions of the referents of an object, as
+        well as the total number of referents."""
+        return self._get_page(self._referents, self._referent_offsets,\
+                              position, offset, limit)
+
+    def get_referrers(self, position, offset, limit):
+        """Get a page of the positions of the referrers of an object, as
+        well as the total number of referrers."""
+        return self._get_page(self._referrers, self._referrer_offsets,\
+                              position, offset, limit)
+
+    def _get_page(self, targets, offsets, position, offset, limit):
+        start = offsets[position]
+        end = offsets[position + 1]
+        first = min(start + offset, end)
+        return (targets[first:min(first + limit, end)], end - start)
+
+    def get_path(self, position, limit):
+        """Get the positions on a path from a root to an object, at most
+        limit of them, and whether the object is reachable at all.
+
+        If the path is longer than limit, its end is returned.
+
+        """
+        if self._parents[position] == -1:
+            return ([], False)
+        res = [position]
+        while (self._parents[position] != position) and (len(res) < limit):
+            position = self._parents[position]
+            res.append(position)
+        res.reverse()
+        return (res, True)
+
+def _describe(o):
+    """Get a short description of an object, in constant time."""
+    try:
+        res = summary._repr(o, 2)
+        if isinstance(o, basestring):
+            res += ' ' + repr(o[:40])
+        return res
+    except Exception:
+        return summary._repr_type(type(o))
+
+def _to_json(value):
+    """Encode a value composed of dicts, lists, strings, and numbers as JSON.
+    """
+    if value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, basestring):
+        return refbrowser._json_escape(value)
+    elif isinstance(value, (int, long)):
+        # repr would append an L to longs
+        return str(value)
+    elif isinstance(value, float):
+        return repr(value)
+    elif isinstance(value, dict):
+        return '{%s}' % ', '.join(['%s: %s' % (_to_json(str(k)), _to_json(v))\
+                                   for (k, v) in value.iteritems()])
+    else:
+        return '[%s]' % ', '.join([_to_json(v) for v in value])
+
+_html = """<html>
+<head><title>muppy heap browser</title></head>
+<body>
+<div id="view"></div>
+<script>
+// all elements are built with the DOM and text nodes, so labels need no
+// escaping and handlers are never built from strings
+var view = document.getElementById("view");
+function get(url, callback) {
+  var request = new XMLHttpRequest();
+  request.onload = function() { callback(JSON.parse(request.responseText)); };
+  request.open("GET", url);
+  request.send();
+}
+function el(tag, text) {
+  var e = document.createElement(tag);
+  if (text !== undefined)
+    e.appendChild(document.createTextNode(text));
+  return e;
+}
+function link(text, handler) {
+  var a = el("a", text);
+  a.href = "#";
+  a.addEventListener("click", function(event) {
+    event.preventDefault();
+    handler();
+  });
+  return a;
+}
+function row(table, cells, tag) {
+  var tr = el("tr");
+  for (var i = 0; i < cells.length; i++) {
+    var cell = el(tag || "td");
+    if (typeof cells[i] === "object")
+      cell.appendChild(cells[i]);
+    else
+      cell.appendChild(document.createTextNode(cells[i]));
+    tr.appendChild(cell);
+  }
+  table.appendChild(tr);
+}
+function pager(data, offset, page) {
+  var p = el("p", offset + "-" + (offset + data.items.length) + " of " +
+              data.total + " ");
+  if (offset > 0)
+    p.appendChild(link("previous", function() {
+      page(Math.max(offset - data.limit, 0));
+    }));
+  if (offset + data.items.length < data.total)
+    p.appendChild(link("next", function() { page(offset + data.limit); }));
+  return p;
+}
+function show_link(o) {
+  return link(o.description, function() { show(o.id); });
+}
+function objects(container, title, data, offset, page) {
+  container.innerHTML = "";
+  container.appendChild(el("h2", title));
+  container.appendChild(pager(data, offset, page));
+  var table = el("table");
+  for (var i = 0; i < data.items.length; i++)
+    row(table, [show_link(data.items[i]), data.items[i].size]);
+  container.appendChild(table);
+}
+function clear() {
+  view.innerHTML = "";
+  view.appendChild(link("summary", function() { summary(0); }));
+}
+function summary(offset) {
+  get("/api/summary?offset=" + offset, function(data) {
+    clear();
+    view.appendChild(el("h1", "Summary"));
+    view.appendChild(pager(data, offset, summary));
+    var table = el("table");
+    row(table, ["type", "objects", "size"], "th");
+    for (var i = 0; i < data.items.length; i++) {
+      var r = data.items[i];
+      row(table, [link(r.type, (function(label) {
+        return function() { type(label, 0); };
+      })(r.type)), r.count, r.size]);
+    }
+    view.appendChild(table);
+  });
+}
+function type(label, offset) {
+  get("/api/objects?type=" + encodeURIComponent(label) + "&offset=" + offset,
+      function(data) {
+    clear();
+    var div = el("div");
+    view.appendChild(div);
+    objects(div, label, data, offset, function(o) { type(label, o); });
+  });
+}
+function list(id, kind, container, offset) {
+  get("/api/" + kind + "?id=" + id + "&offset=" + offset, function(data) {
+    objects(container, kind, data, offset, function(o) {
+      list(id, kind, container, o);
+    });
+  });
+}
+function show(id) {
+  get("/api/object?id=" + id, function(o) {
+    clear();
+    view.appendChild(el("h1", o.description));
+    view.appendChild(el("p", "id " + o.id + ", " + o.size + " bytes"));
+    var path = el("div");
+    var referrers = el("div");
+    var referents = el("div");
+    view.appendChild(path);
+    view.appendChild(referrers);
+    view.appendChild(referents);
+    get("/api/path?id=" + id, function(data) {
+      path.appendChild(el("h2", "Path from a root"));
+      for (var i = 0; i < data.items.length; i++) {
+        if (i > 0)
+          path.appendChild(document.createTextNode(" \u2192 "));
+        path.appendChild(show_link(data.items[i]));
+      }
+    });
+    list(id, "referrers", referrers, 0);
+    list(id, "referents", referents, 0);
+  });
+}
+summary(0);
+</script>
+</body>
+</html>
+"""
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handler of requests to the HeapBrowser."""
+
+    def do_GET(self):
+        # pages of other hosts may resolve their name to 127.0.0.1 (DNS
+        # rebinding), so requests must name this server as their host
+        port = self.server.browser.port
+        if self.headers.get('Host') not in ['127.0.0.1:%s' % port,\
+                                            'localhost:%s' % port]:
+            self.send_error(403)
+            return
+        url = urlparse.urlparse(self.path)
+        params = cgi.parse_qs(url[4])
+        handler = self.server.browser._handlers.get(url[2])
+        if handler is None:
+            self.send_error(404)
+            return
+        try:
+            (content_type, body) = handler(params)
+        except (KeyError, ValueError), e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # do not write to stderr for every request
+        pass
+
+class HeapBrowser(object):
+    """Browse a snapshot of all objects with a web browser.
+
+    The snapshot is captured when the HeapBrowser is created. The server
+    only accepts connections from localhost, and only requests addressed to
+    127.0.0.1 or localhost.
+
+    """
+    def __init__(self, port=8080, page_size=100, roots=None):
+        """Constructor.
+
+        keyword arguments
+        port -- the port to listen on, 0 picks a free port
+        page_size -- the default number of items per page
+        roots -- objects from which paths to objects are searched, per
+                 default sys.modules
+        """
+        self.page_size = page_size
+        # maximum number of items per page which may be requested
+        self.max_page_size = 10 * page_size
+        self.snapshot = _Snapshot(roots)
+        self._handlers = {'/': self._get_html,
+                          '/api/summary': self._get_summary,
+                          '/api/objects': self._get_objects,
+                          '/api/object': self._get_object,
+                          '/api/referrers': self._get_referrers,
+                          '/api/referents': self._get_referents,
+                          '/api/path': self._get_path}
+        self._server = BaseHTTPServer.HTTPServer(('127.0.0.1', port),\
+                                                 _RequestHandler)
+        self._server.browser = self
+        self.port = self._server.server_address[1]
+        self._thread = None
+
+    def serve_forever(self):
+        """Handle requests until the process is interrupted."""
+        print "Serving heap browser on http://127.0.0.1:%s/" % self.port
+        self._server.serve_forever()
+
+    def start(self):
+        """Handle requests on a background thread."""
+        if self._thread is not None:
+            raise RuntimeError("heap browser is already running")
+        self._thread = threading.Thread(target=self._server.serve_forever,\
+                                        name="muppy.HeapBrowser")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop handling requests and close the server."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def _get_page_params(self, params):
+        """Get the offset and limit parameters of a request."""
+        offset = int(params.get('offset', [0])[0])
+        limit = int(params.get('limit', [self.page_size])[0])
+        if (offset < 0) or (limit < 0):
+            raise ValueError("offset and limit must not be negative")
+        return (offset, min(limit, self.max_page_size))
+
+    def _get_position(self, params):
+        """Get the position of the object identified by the id parameter."""
+        position = self.snapshot.get_position(int(params['id'][0]))
+        if position is None:
+            raise KeyError("no such object")
+        return position
+
+    def _describe(self, position):
+        o = self.snapshot.objects[position]
+        return {'id': id(o),
+                'description': _describe(o),
+                'size': self.snapshot.sizes[position]}
+
+    def _page(self, positions, total, offset, limit):
+        return ('application/json',\
+                _to_json({'items': [self._describe(p) for p in positions],\
+                          'total': total,\
+                          'offset': offset,\
+                          'limit': limit}))
+
+    def _get_html(self, params):
+        return ('text/html', _html)
+
+    def _get_summary(self, params):
+        (offset, limit) = self._get_page_params(params)
+        rows = self.snapshot.summary[offset:offset + limit]
+        return ('application/json',\
+                _to_json({'items': [{'type': row[0], 'count': row[1],\
+                                     'size': row[2]} for row in rows],\
+                          'total': len(self.snapshot.summary),\
+                          'offset': offset,\
+                          'limit': limit}))
+
+    def _get_objects(self, params):
+        (offset, limit) = self._get_page_params(params)
+        (positions, total) = self.snapshot.get_objects(params['type'][0],\
+                                                       offset, limit)
+        return self._page(positions, total, offset, limit)
+
+    def _get_object(self, params):
+        return ('application/json',\
+                _to_json(self._describe(self._get_position(params))))
+
+    def _get_referrers(self, params):
+        (offset, limit) = self._get_page_params(params)
+        (positions, total) =\
+            self.snapshot.get_referrers(self._get_position(params), offset,\
+                                        limit)
+        return self._page(positions, total, offset, limit)
+
+    def _get_referents(self, params):
+        (offset, limit) = self._get_page_params(params)
+        (positions, total) =\
+            self.snapshot.get_referents(self._get_position(params), offset,\
+                                        limit)
+        return self._page(positions, total, offset, limit)
+
+    def _get_path(self, params):
+        (offset, limit) = self._get_page_params(params)
+        (positions, reachable) = self.snapshot.get_path(\
+                                     self._get_position(params), limit)
+        return ('application/json',\
+                _to_json({'items': [self._describe(p) for p in positions],\
+                          'reachable': reachable}))
+
+def sample_browser():
+    browser = HeapBrowser()
+    browser.serve_forever()
+
+if __name__ == "__main__":
+    sample_browser()
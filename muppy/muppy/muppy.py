@@ -1,4 +1,6 @@
 import gc
+import inspect
+import types
 
 import summary
 
@@ -213,6 +215,61 @@ def _get_usage(function, *args):
         res = tmp
     return res
 
+def _get_snapshot(ignore=(), module_globals=(), owner=None,
+                  referents=False):
+    """Get all objects tracked by the garbage collector after a collection.
+
+    Objects are excluded by identity, so no __eq__ methods are called.
+    Besides the objects whose ids are in ignore, the frames of functions of
+    this module and of the modules whose globals are passed are excluded,
+    i.e. the frames of whoever takes the snapshot. Objects created while
+    the snapshot is taken are not included either.
+
+    Keyword arguments:
+    ignore -- set of the ids of objects to exclude
+    module_globals -- globals() of the modules whose frames are excluded
+    owner -- if not None, bound methods of this object are excluded
+    referents -- if True, objects referred to by the snapshot which are
+                 not tracked by the garbage collector are included as well
+
+    """
+    gc.collect()
+    tmp = gc.get_objects()
+    # anything created from here on is not in tmp
+    ignored = set(ignore)
+    ignored.update([id(ignore), id(module_globals)])
+    frame = inspect.currentframe()
+    while frame is not None:
+        if frame.f_globals is globals():
+            ignored.add(id(frame))
+        else:
+            for g in module_globals:
+                if frame.f_globals is g:
+                    ignored.add(id(frame))
+        frame = frame.f_back
+    res = []
+    seen = set()
+    for o in tmp:
+        if (id(o) in ignored) or (id(o) in seen):
+            continue
+        if (owner is not None) and (type(o) is types.MethodType) and\
+           (o.im_self is owner):
+            continue
+        seen.add(id(o))
+        res.append(o)
+        if not referents:
+            continue
+        # gc.get_objects returns only container objects, but we also want
+        # the objects referenced by them
+        for ref in gc.get_referents(o):
+            if (not _is_containerobject(ref)) and (id(ref) not in seen) and\
+               (id(ref) not in ignored):
+                seen.add(id(ref))
+                res.append(ref)
+    # tmp references the current frame, which references tmp
+    del tmp
+    return res
+
 def _is_containerobject(o):
     """Is the passed object a container object."""
     if type(o).__flags__ & __TPFLAGS_HAVE_GC == 0:
@@ -2,7 +2,11 @@
 
 This module provides a base implementation for tree-like referrers browsing.
 The two non-interactive classes ConsoleBrowser and FileBrowser output a tree
-to the console or a file. Further types can be subclassed.
+to the console or a file. The GraphBrowser exports the graph of referrers in
+the Graphviz DOT format or as JSON. Further types can be subclassed.
+
+The ReferentBrowser explores the opposite direction, i.e. the objects which
+are referred to by the root object, annotated with their sizes.
 
 All types share a similar initialisation. That is, you provide a root object
 and may specify further settings such as the initial depth of the tree or an
@@ -10,12 +14,18 @@ output function.
 Afterwards you can print the tree which will be arranged based on your previous
 settings.
 """
+import array
 import gc
 import inspect
+import random
 import sys
+import time
+import types
 
 import muppy
 import summary
+from muppy import _getsizeof
+from utils import asizeof
 
 class _Node(object):
     """A node as it is used in the tree structure.
@@ -23,8 +33,13 @@ class _Node(object):
     Each node contains the object it represents and a list of children.
     Children can be other nodes or arbitrary other objects. Any object
     in a tree which is not of the type _Node is considered a leaf.
+
+    Nodes have no __dict__, so that they do not add dictionaries to the
+    referrers of the objects they represent.
     
     """
+    __slots__ = ['o', 'children', 'str_func']
+
     def __init__(self, o, str_func=None):
         """You have to define the object this node represents. Also you can
         define an output function which will be used to represent this node.
@@ -45,6 +60,39 @@ class _Node(object):
         else:
             return str(self.o)
 
+class _ReferrerIndex(object):
+    """Index of the referrers of all objects at the time of its creation.
+
+    Each call of gc.get_referrers walks all objects tracked by the garbage
+    collector. The index walks them once and afterwards looks up the
+    referrers of an object in constant time. Note that the index keeps all
+    indexed objects alive, and that objects created after the index are not
+    included.
+
+    """
+    def __init__(self):
+        self._objects = muppy._get_snapshot(set([id(self),\
+                                                 id(self.__dict__)]),\
+                                            [globals()])
+        # indices into _objects of the referrers of each object id
+        self._referrers = {}
+        for index in xrange(len(self._objects)):
+            for ref in gc.get_referents(self._objects[index]):
+                referrers = self._referrers.get(id(ref))
+                if referrers is None:
+                    referrers = self._referrers[id(ref)] = array.array('l')
+                # an object may refer to the same object repeatedly
+                elif referrers[-1] == index:
+                    continue
+                referrers.append(index)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def get_referrers(self, o):
+        """Get the list of indexed objects which refer to o."""
+        return [self._objects[i] for i in self._referrers.get(id(o), ())]
+
 class RefBrowser(object):
     """Base class to other RefBrowser implementations.
 
@@ -54,7 +102,9 @@ class RefBrowser(object):
     
     """
 
-    def __init__(self, rootobject, maxdepth=3, str_func=summary._repr, repeat=True):
+    def __init__(self, rootobject, maxdepth=3, str_func=summary._repr, repeat=True,
+                 fanout=None, sample=False, max_nodes=None, max_time=None,
+                 index=None):
         """You have to provide the root object used in the refbrowser. 
         
         keyword arguments
@@ -62,23 +112,142 @@ class RefBrowser(object):
         str_func -- function used when calling str(node)
         repeat -- should nodes appear repeatedly in the tree, or should be
                   referred to existing nodes
+        fanout -- maximum number of referrers included per node, the others
+                  are aggregated by their label, e.g. "+42 more dict"
+        sample -- include a random sample of referrers instead of the first
+                  ones if there are more than fanout
+        max_nodes -- maximum number of nodes created per tree
+        max_time -- maximum number of seconds spent building a tree
+        index -- _ReferrerIndex used to look up referrers instead of
+                 gc.get_referrers
+
+        If repeat is True, the tree is built as a graph in which objects
+        found repeatedly share a single node, see _get_graph.
+
+        If max_nodes or max_time is exceeded, the tree is cut short and the
+        attribute truncated is set to 'max_nodes' or 'max_time'.
 
         """        
         self.root = rootobject
         self.maxdepth = maxdepth
         self.str_func = str_func
         self.repeat = repeat
-        # objects which should be ignored while building the tree
+        self.fanout = fanout
+        self.sample = sample
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.index = index
+        # reason why the last tree was cut short, if it was
+        self.truncated = None
+        self._nodes = 0
+        self._deadline = None
+        # ids of objects which should be ignored while building the tree
         # e.g. the current frame
-        self.ignore = []
+        self.ignore = set()
         # set of object ids which are already included
         self.already_included = set()
-        self.ignore.append(self.already_included)
+        self.ignore.add(id(self.__dict__))
+        self.ignore.add(id(self.already_included))
 
     def get_tree(self):
         """Get a tree of referrers of the root object."""
-        self.ignore.append(inspect.currentframe())
-        return self._get_tree(self.root, self.maxdepth)
+        return self._build(self.root, self.maxdepth)
+
+    def _build(self, root, maxdepth, writer=None):
+        """Get a tree of referrers of root within a new node and time budget.
+
+        If a _TreeWriter is passed, the tree is written while it is built
+        instead and None is returned. Only the nodes on the path currently
+        written and their siblings are kept, see _get_children.
+
+        """
+        frame = inspect.currentframe()
+        self.ignore.add(id(frame))
+        self.truncated = None
+        self._nodes = 0
+        self._deadline = None
+        if self.max_time is not None:
+            self._deadline = time.time() + self.max_time
+        try:
+            if writer is not None:
+                node = _Node(root, self.str_func)
+                self._nodes += 1
+                self.already_included.add(id(root))
+                writer.write(node)
+                return None
+            if self.repeat:
+                return self._get_graph(root, maxdepth)
+            return self._get_tree(root, maxdepth)
+        finally:
+            self.ignore.discard(id(frame))
+            del frame
+
+    def _in_budget(self):
+        """Check whether further nodes may be created.
+
+        If not, the exceeded budget is recorded in truncated.
+
+        """
+        if self.truncated is None:
+            if (self.max_nodes is not None) and\
+               (self._nodes >= self.max_nodes):
+                self.truncated = 'max_nodes'
+            elif (self._deadline is not None) and\
+                 (time.time() > self._deadline):
+                self.truncated = 'max_time'
+        return self.truncated is None
+
+    def _get_referrers(self, o):
+        """Get the referrers of o, from the index if there is one."""
+        if self.index is not None:
+            return self.index.get_referrers(o)
+        return gc.get_referrers(o)
+
+    def _label(self, o):
+        """Get the label of an object."""
+        if self.str_func is not None:
+            return self.str_func(o)
+        else:
+            return str(o)
+
+    def _select(self, objects):
+        """Select the referrers which are included in the tree.
+
+        Ignored objects and the frames of this module, e.g. of a tree being
+        written, are left out. If more than fanout referrers remain,
+        only fanout of them are selected. Return the selected referrers and
+        a list of strings which aggregate the others by their label.
+
+        """
+        selected = [o for o in objects\
+                    if (id(o) not in self.ignore) and\
+                       not isinstance(o, _Node) and\
+                       not ((type(o) is types.FrameType) and\
+                            (o.f_globals is globals()))]
+        if (self.fanout is None) or (len(selected) <= self.fanout):
+            return (selected, [])
+        if self.sample:
+            indices = random.sample(xrange(len(selected)), self.fanout)
+            indices.sort()
+            chosen = set(indices)
+            rest = [selected[i] for i in xrange(len(selected))\
+                    if i not in chosen]
+            selected = [selected[i] for i in indices]
+        else:
+            rest = selected[self.fanout:]
+            del selected[self.fanout:]
+        return (selected, self._aggregate(rest))
+
+    def _aggregate(self, objects):
+        """Get strings which aggregate objects by their label, e.g.
+        "+42 more dict", the most frequent labels first."""
+        counts = {}
+        for o in objects:
+            label = self._label(o)
+            counts[label] = counts.get(label, 0) + 1
+        labels = counts.keys()
+        labels.sort(lambda l1, l2: counts[l2] - counts[l1] or cmp(l1, l2))
+        return ["+%s more %s" % (counts[label], label) for label in labels]
     
     def _get_tree(self, root, maxdepth):
         """Workhorse of the get_tree implementation.
@@ -89,31 +258,251 @@ class RefBrowser(object):
         maxdepth defines how much further down the from the root the tree
         should be build.
 
+        Objects are ignored by identity. The frame of this call and the list
+        of referrers are only ignored while the call is in progress.
+
         """
-        self.ignore.append(inspect.currentframe())
         res = _Node(root, self.str_func)
+        self._nodes += 1
         self.already_included.add(id(root))
         if maxdepth == 0:
             return res
-        objects = gc.get_referrers(root)
-        self.ignore.append(objects)
-        for o in objects:
-            # XXX: find a better way to ignore dict of _Node objects
-            if isinstance(o, dict):
-                sampleNode = _Node(1)
-                if sampleNode.__dict__.keys() == o.keys():
+        frame = inspect.currentframe()
+        objects = self._get_referrers(root)
+        transient = [id(frame), id(objects)]
+        self.ignore.update(transient)
+        try:
+            (selected, aggregated) = self._select(objects)
+            transient.append(id(selected))
+            self.ignore.add(id(selected))
+            for i in range(len(selected)):
+                o = selected[i]
+                _id = id(o)
+                if _id in self.already_included:
+                    res.children.append("%s (already included, id %s)" %\
+                                        (self._label(o), _id))
                     continue
-            _id = id(o)
-            if not self.repeat and (_id in self.already_included):
-                if self.str_func is not None: s = self.str_func(o)
-                else: s = str(o)
-                res.children.append("%s (already included, id %s)" %\
-                                    (s, _id))
-                continue
-            if (not isinstance(o, _Node)) and (o not in self.ignore):
+                if not self._in_budget():
+                    res.children.extend(self._aggregate(selected[i:]))
+                    break
                 res.children.append(self._get_tree(o, maxdepth-1))
+            res.children.extend(aggregated)
+        finally:
+            self.ignore.difference_update(transient)
+            del frame
         return res
 
+    def _get_children(self, node):
+        """Get the children of a node without adding them to it.
+
+        This is used to write trees while they are built if repeat is False.
+        Unlike _get_tree, all children of a node are determined when the node
+        is expanded, so an object found by several nodes is expanded within
+        the first node expanded, not within the first one written.
+
+        """
+        frame = inspect.currentframe()
+        objects = self._get_referrers(node.o)
+        transient = [id(frame), id(objects)]
+        self.ignore.update(transient)
+        selected = None
+        try:
+            (selected, aggregated) = self._select(objects)
+            transient.append(id(selected))
+            self.ignore.add(id(selected))
+            res = []
+            for i in range(len(selected)):
+                o = selected[i]
+                _id = id(o)
+                if _id in self.already_included:
+                    res.append("%s (already included, id %s)" %\
+                               (self._label(o), _id))
+                    continue
+                if not self._in_budget():
+                    res.extend(self._aggregate(selected[i:]))
+                    break
+                res.append(_Node(o, self.str_func))
+                self._nodes += 1
+                self.already_included.add(_id)
+            res.extend(aggregated)
+            return res
+        finally:
+            self.ignore.difference_update(transient)
+            objects = selected = o = None
+            del frame
+
+    def _get_graph(self, root, maxdepth):
+        """Get the referrers of root as a graph of nodes.
+
+        Each object is represented by a single node, and the referrers of
+        each object are computed only once. Nodes of objects which are found
+        repeatedly are shared, so the size of the graph does not grow
+        exponentially with maxdepth. The graph is built breadth-first, so
+        every object is expanded at the lowest depth it is found at. Note
+        that the graph contains cycles if objects refer to each other; it is
+        up to the renderers to expand it no deeper than maxdepth.
+
+        """
+        frame = inspect.currentframe()
+        self.ignore.add(id(frame))
+        try:
+            res = _Node(root, self.str_func)
+            self._nodes += 1
+            nodes = {id(root): res}
+            level = [res]
+            for depth in range(maxdepth):
+                next_level = []
+                for node in level:
+                    if not self._in_budget():
+                        break
+                    objects = self._get_referrers(node.o)
+                    self.ignore.add(id(objects))
+                    selected = rest = None
+                    try:
+                        (selected, aggregated) = self._select(objects)
+                        rest = []
+                        for o in selected:
+                            child = nodes.get(id(o))
+                            if child is None:
+                                if not self._in_budget():
+                                    rest.append(o)
+                                    continue
+                                child = _Node(o, self.str_func)
+                                self._nodes += 1
+                                nodes[id(o)] = child
+                                next_level.append(child)
+                            node.children.append(child)
+                        node.children.extend(self._aggregate(rest))
+                        node.children.extend(aggregated)
+                    finally:
+                        self.ignore.discard(id(objects))
+                        # the next objects to expand are in these lists
+                        objects = selected = rest = o = None
+                level = next_level
+            self.already_included.update(nodes)
+            return res
+        finally:
+            self.ignore.discard(id(frame))
+            del frame
+
+class _TreeWriter(object):
+    """Writes trees in the text format of the ConsoleBrowser to a file.
+
+    Lines are written as soon as they are complete, but collected in a
+    buffer first to reduce the number of writes. The label of each node is
+    computed only once, even if the node appears repeatedly.
+
+    If an expand function is given, the children of each node are
+    requested from it when the node is written, so a tree can be written
+    while it is built. The children are then dropped as soon as they are
+    written.
+
+    """
+    def __init__(self, out, maxdepth, hline='-', vline='|', cross='+',
+                 space=' ', buffer_size=256, expand=None):
+        """Constructor.
+
+        Keyword arguments:
+        out -- file-like object to write to
+        maxdepth -- maximum depth up to which trees are written
+        hline, vline, cross, space -- characters used to draw the tree
+        buffer_size -- number of lines to collect before writing
+        expand -- function which returns the children of a node, instead of
+                  the children attribute
+        """
+        self.out = out
+        self.maxdepth = maxdepth
+        self.hline = hline
+        self.vline = vline
+        self.cross = cross
+        self.space = space
+        self.buffer_size = buffer_size
+        self.expand = expand
+        self._buffer = []
+        self._labels = {}
+        # pieces of the current line and of the lines carrying on below it
+        self._line = []
+        self._carryon = []
+
+    def write(self, tree):
+        """Write a tree."""
+        try:
+            self._write(tree, 0)
+            self._flush()
+        finally:
+            self._labels.clear()
+            self._line = []
+            self._carryon = []
+
+    def _emit(self, line):
+        """Write a line (buffered)."""
+        self._buffer.append(line + '\n')
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        """Write all buffered lines."""
+        if self._buffer:
+            self.out.write(''.join(self._buffer))
+            self._buffer = []
+
+    def _label(self, tree):
+        """Get the label of a node or leaf."""
+        # nodes created by expand are written once and their ids reused
+        if (not isinstance(tree, _Node)) or (self.expand is not None):
+            return str(tree)
+        label = self._labels.get(id(tree))
+        if label is None:
+            label = self._labels[id(tree)] = str(tree)
+        return label
+
+    def _write(self, tree, level):
+        """Write a node and its children, starting on the current line.
+
+        This is a recursive function.
+
+        """
+        line = self._line
+        carryon = self._carryon
+        label = self._label(tree)
+        line.append(label)
+        children = ()
+        if (level < self.maxdepth) and isinstance(tree, _Node):
+            if self.expand is not None:
+                children = self.expand(tree)
+            else:
+                children = tree.children
+        if len(children) == 0:
+            self._emit(''.join(line))
+            del line[:]
+            return
+        carryon.append(self.space * len(label))
+        # add in between connections, and a cross if there is more than one
+        # branch
+        if len(children) > 1:
+            line.append(self.hline + self.cross + self.hline)
+            carryon.append(self.space + self.vline + self.space)
+        else:
+            line.append(self.hline + self.hline)
+            carryon.append(self.space + self.space)
+        # print the first branch (on the same line)
+        self._write(children[0], level + 1)
+        for b in range(1, len(children)):
+            last = (b == len(children) - 1)
+            # remove the vline for any children of the last branch
+            if last:
+                carryon[-1] = self.space * 3
+            line.extend(carryon[:-1])
+            line.append(self.space + self.cross + self.hline)
+            self._write(children[b], level + 1)
+            # leave a free line before the next branch
+            if last:
+                rest = ''.join(carryon)
+                if len(rest.strip(' ')) > 0:
+                    self._emit(rest[:-2].rstrip())
+        del carryon[-2:]
+
+
 class ConsoleBrowser(RefBrowser):
     """RefBrowser implementation which prints the tree to the console.
 
@@ -132,64 +521,32 @@ class ConsoleBrowser(RefBrowser):
         
         keyword arguments
         tree -- if not None, the passed tree will be printed. Otherwise it is
-        based on the rootobject.
+        based on the rootobject, and printed while it is built.
                    
         """
-        if tree == None:
-            self._print(self.get_tree(), '', '')
-        else:
-            self._print(tree, '', '')
-        
-    def _print(self, tree, prefix, carryon):
-        """Compute and print a new line of the tree.
+        self._write(tree, sys.stdout)
+
+    def _write(self, tree, out):
+        """Write the tree to the file-like object out.
+
+        If tree is None and repeat is False, the tree of the root object is
+        written while it is built, so it is never kept in memory as a whole.
+        If repeat is True, the graph of the root object is built first, so
+        the referrers of each object are looked up only once. Its size is
+        bounded by the number of objects it contains.
 
-        This is a recursive function.
-        
-        arguments
-        tree -- tree to print
-        prefix -- prefix to the current line to print
-        carryon -- prefix which is used to carry on the vertical lines
-        
         """
-        level = prefix.count(self.cross) + prefix.count(self.vline)
-        len_children = 0
-        if isinstance(tree , _Node):
-            len_children = len(tree.children)
-
-        # add vertex
-        prefix += str(tree)
-        # and as many spaces as the vertex is long
-        carryon += self.space * len(str(tree))
-        if (level == self.maxdepth) or (not isinstance(tree, _Node)) or\
-           (len_children == 0):
-            print prefix
-            return
+        if (tree is None) and self.repeat:
+            tree = self.get_tree()
+        if tree is None:
+            writer = _TreeWriter(out, self.maxdepth, self.hline, self.vline,
+                                 self.cross, self.space,
+                                 expand=self._get_children)
+            self._build(self.root, self.maxdepth, writer)
         else:
-            # add in between connections
-            prefix += self.hline
-            carryon += self.space
-            # if there is more than one branch, add a cross
-            if len(tree.children) > 1:
-                prefix += self.cross
-                carryon += self.vline
-            prefix += self.hline
-            carryon += self.space
-
-            if len_children > 0:
-                # print the first branch (on the same line)
-                self._print(tree.children[0], prefix, carryon)
-                for b in range(1, len_children):
-                    # the caryon becomes the prefix for all following children
-                    prefix = carryon[:-2] + self.cross + self.hline
-                    # remove the vlines for any children of last branch 
-                    if b == (len_children-1):
-                        carryon = carryon[:-2] + 2*self.space
-                    self._print(tree.children[b], prefix, carryon)
-                    # leave a free line before the next branch
-                    if b == (len_children-1):
-                        if len(carryon.strip(' ')) == 0:
-                            return
-                        print carryon[:-2].rstrip()
+            writer = _TreeWriter(out, self.maxdepth, self.hline, self.vline,
+                                 self.cross, self.space)
+            writer.write(tree)
 
 class FileBrowser(ConsoleBrowser):
     """RefBrowser implementation which prints the tree to a file."""
@@ -198,22 +555,252 @@ class FileBrowser(ConsoleBrowser):
         """ Print referrers tree to file (in text format).
         
         keyword arguments
-        tree -- if not None, the passed tree will be printed.
+        tree -- if not None, the passed tree will be printed. Otherwise the
+                tree of the root object is printed while it is built.
                    
         """
-        old_stdout = sys.stdout
         fsock = open(filename, 'w')
-        sys.stdout = fsock
         try:
-            self._print(self.get_tree(), '', '') 
-            sys.stdout = old_stdout
-            fsock.close()
-        except Exception:
-            print "Unexpected error:", sys.exc_info()[0]
+            self._write(tree, fsock)
         finally:
-            sys.stdout = old_stdout
             fsock.close()
 
+class GraphBrowser(RefBrowser):
+    """RefBrowser implementation which exports the graph of referrers.
+
+    Each object is exported once, annotated with its id, label, and flat
+    size, and optionally its deep size as computed by asizeof. The edges
+    lead from each object to the objects it refers to. Leaves which do not
+    represent objects, e.g. aggregated referrers, are exported as notes of
+    the object they belong to.
+
+    Objects are written as soon as they are visited, so large graphs can be
+    exported to files and processed by external tools.
+
+    """
+    def _walk(self, tree):
+        """Iterate over (node, referrer nodes, notes) tuples of the graph,
+        each object only once."""
+        if tree is None:
+            tree = self.get_tree()
+        visited = set([id(tree.o)])
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            referrers = []
+            notes = []
+            for child in node.children:
+                if not isinstance(child, _Node):
+                    notes.append(str(child))
+                    continue
+                referrers.append(child)
+                if id(child.o) not in visited:
+                    visited.add(id(child.o))
+                    stack.append(child)
+            yield (node, referrers, notes)
+
+    def _get_sizes(self, node, deep):
+        """Get the flat and, if deep is True, deep size of a node's object."""
+        deep_size = None
+        if deep:
+            deep_size = asizeof.asizeof(node.o)
+        return (_getsizeof(node.o), deep_size)
+
+    def write_dot(self, out, tree=None, deep=False):
+        """Write the graph in the Graphviz DOT format.
+
+        keyword arguments
+        out -- file-like object to write to
+        tree -- if not None, the passed tree will be exported. Otherwise it
+                is based on the rootobject.
+        deep -- annotate objects with their deep size
+        """
+        out.write('digraph referrers {\n')
+        out.write('  node [shape=box];\n')
+        for (node, referrers, notes) in self._walk(tree):
+            (size, deep_size) = self._get_sizes(node, deep)
+            label = '%s\\nid %s, %s bytes' %\
+                    (summary._dot_escape(str(node)), id(node.o), size)
+            if deep_size is not None:
+                label += ' (%s deep)' % deep_size
+            for note in notes:
+                label += '\\n' + summary._dot_escape(note)
+            out.write('  n%s [label="%s"];\n' % (id(node.o), label))
+            for referrer in referrers:
+                out.write('  n%s -> n%s;\n' % (id(referrer.o), id(node.o)))
+        out.write('}\n')
+
+    def write_json(self, out, tree=None, deep=False):
+        """Write the graph as JSON.
+
+        The result is an object with a list of nodes. Each node has the
+        attributes id, label, size, deep_size (null unless requested),
+        referrers (a list of ids), and notes (a list of strings).
+
+        keyword arguments
+        out -- file-like object to write to
+        tree -- if not None, the passed tree will be exported. Otherwise it
+                is based on the rootobject.
+        deep -- annotate objects with their deep size
+        """
+        out.write('{"nodes": [')
+        separator = '\n'
+        for (node, referrers, notes) in self._walk(tree):
+            (size, deep_size) = self._get_sizes(node, deep)
+            if deep_size is None:
+                deep_size = 'null'
+            out.write('%s{"id": %s, "label": %s, "size": %s, "deep_size": %s, '\
+                      '"referrers": [%s], "notes": [%s]}' %\
+                      (separator, id(node.o), _json_escape(str(node)), size,\
+                       deep_size,\
+                       ', '.join([str(id(r.o)) for r in referrers]),\
+                       ', '.join([_json_escape(n) for n in notes])))
+            separator = ',\n'
+        out.write('\n]}\n')
+
+class _ReferentNode(_Node):
+    """A node of the ReferentBrowser, annotated with the flat and deep size
+    of the object it represents."""
+    __slots__ = ['size', 'deep_size', 'expanded']
+
+    def __init__(self, o, str_func=None, size=0, deep_size=0):
+        _Node.__init__(self, o, str_func)
+        self.size = size
+        self.deep_size = deep_size
+        self.expanded = False
+
+    def __str__(self):
+        return "%s (%s bytes, %s deep)" % (_Node.__str__(self), self.size,\
+                                           self.deep_size)
+
+class ReferentBrowser(object):
+    """Lazy exploration of the objects referred to by a root object.
+
+    Nodes are expanded on demand. The children of a node are the objects
+    its object refers to, sorted by their deep size, largest first, and
+    limited to the top ones. The others are aggregated into a single leaf.
+
+    All sizes are computed with a single Asizer. The children of a node are
+    sized in one pass, so structures shared by siblings are counted only
+    once, and references back to the ancestors of a node are not counted.
+    Each object is sized only once, even if it is reached repeatedly.
+
+    """
+    def __init__(self, rootobject, maxdepth=3, str_func=summary._repr, top=10):
+        """You have to provide the root object used in the browser.
+
+        keyword arguments
+        maxdepth -- maximum depth of the tree returned by get_tree
+        str_func -- function used when calling str(node)
+        top -- maximum number of children per node
+        """
+        self.root = rootobject
+        self.maxdepth = maxdepth
+        self.str_func = str_func
+        self.top = top
+        self._asizer = asizeof.Asizer()
+        # node of each object reached so far
+        self._nodes = {}
+        self._root_node = None
+
+    def get_root(self):
+        """Get the (unexpanded) node of the root object."""
+        if self._root_node is None:
+            self._root_node = self._get_nodes([self.root], [])[0]
+        return self._root_node
+
+    def _get_nodes(self, objects, ancestors):
+        """Get the nodes of objects, sizing the objects not sized before."""
+        new = [o for o in objects if id(o) not in self._nodes]
+        if new:
+            self._asizer.reset()
+            self._asizer.exclude_refs(*ancestors)
+            sizes = self._asizer.asizesof(*new)
+            for i in range(len(new)):
+                self._nodes[id(new[i])] = _ReferentNode(new[i], self.str_func,\
+                                                        _getsizeof(new[i]),\
+                                                        sizes[i])
+        return [self._nodes[id(o)] for o in objects]
+
+    def expand(self, node, ancestors=()):
+        """Compute the children of a node, unless already done.
+
+        keyword arguments
+        ancestors -- objects on the path to the node, which are not counted
+                     in the deep sizes of its children
+        """
+        if node.expanded:
+            return node.children
+        objects = []
+        seen = set()
+        for o in gc.get_referents(node.o):
+            if id(o) not in seen:
+                seen.add(id(o))
+                objects.append(o)
+        children = self._get_nodes(objects, list(ancestors) + [node.o])
+        children.sort(lambda c1, c2: c2.deep_size - c1.deep_size)
+        rest = children[self.top:]
+        node.children = children[:self.top]
+        if rest:
+            deep_size = 0
+            for child in rest:
+                deep_size += child.deep_size
+            node.children.append("+%s more (%s bytes deep)" % (len(rest),\
+                                                               deep_size))
+        node.expanded = True
+        return node.children
+
+    def get_tree(self):
+        """Get the tree of referents of the root object, expanded up to
+        maxdepth."""
+        root = self.get_root()
+        visited = set([id(root)])
+        level = [(root, ())]
+        for depth in range(self.maxdepth):
+            next_level = []
+            for (node, ancestors) in level:
+                for child in self.expand(node, ancestors):
+                    if isinstance(child, _Node) and (id(child) not in visited):
+                        visited.add(id(child))
+                        next_level.append((child, ancestors + (node.o,)))
+            level = next_level
+        return root
+
+    def print_tree(self, out=None):
+        """Print the tree of referents of the root object.
+
+        keyword arguments
+        out -- file-like object to write to, per default sys.stdout
+        """
+        if out is None:
+            out = sys.stdout
+        _TreeWriter(out, self.maxdepth).write(self.get_tree())
+
+# characters which must be escaped in JSON strings
+_json_escapes = {'"': '\\"', '\\': '\\\\', '\n': '\\n', '\r': '\\r',
+                 '\t': '\\t'}
+
+def _json_escape(s):
+    """Get a quoted JSON string of s."""
+    if isinstance(s, str):
+        s = s.decode('utf-8', 'replace')
+    res = []
+    for c in s:
+        if c in _json_escapes:
+            res.append(_json_escapes[c])
+        elif (c < u' ') or (c > u'~'):
+            code = ord(c)
+            if code > 0xffff:
+                # characters beyond the BMP are escaped as surrogate pairs
+                code -= 0x10000
+                res.append('\\u%04x\\u%04x' % (0xd800 + (code >> 10),\
+                                              0xdc00 + (code & 0x3ff)))
+            else:
+                res.append('\\u%04x' % code)
+        else:
+            res.append(str(c))
+    return '"%s"' % ''.join(res)
+
 # list to hold to referrers
 superlist = []
 root = "root"
@@ -5,7 +5,9 @@ have Tcl/Tk installed.
 
 
 """
+import Queue
 import sys
+import threading
 
 try:
     import Tkinter
@@ -20,6 +22,9 @@ import muppy
 import refbrowser
 import summary
 
+# placeholder shown while referrers are computed
+_LOADING = "loading..."
+
 def default_str_function(o):
     """Default str function for InteractiveBrowser."""
     return summary._repr(o) + '(id=%s)' % id(o)
@@ -31,11 +36,58 @@ class _TreeNode(TreeWidget.TreeNode):
     context. 
 
     """
+    def __init__(self, canvas, parent, item):
+        TreeWidget.TreeNode.__init__(self, canvas, parent, item)
+        item.treenode = self
+
     def reload_referrers(self):
         """Reload all referrers for this _TreeNode."""
-        self.item.node = self.item.reftree._get_tree(self.item.node.o, 1)
-        self.item._clear_children()
+        self.item.reftree._cancel(self.item)
+        self.item.node.children = []
+        self.item.loaded = False
+        self.refresh()
         self.expand()
+
+    def cancel(self):
+        """Cancel the computation of referrers for this _TreeNode.
+
+        The referrers computed so far are kept. Reload the referrers to
+        compute all of them again.
+
+        """
+        if self.item.pending:
+            self.item.reftree._cancel(self.item)
+            self.refresh()
+
+    def collapse(self, event=None):
+        """Override collapse from TreeWidget.TreeNode.
+
+        Referrers which are still being computed are not needed anymore.
+
+        """
+        self.cancel()
+        TreeWidget.TreeNode.collapse(self, event)
+
+    def refresh(self):
+        """Recreate the children of this _TreeNode and redraw the tree."""
+        for child in self.children:
+            child.destroy()
+        self.children = []
+        self.update()
+
+    def sync(self):
+        """Add children for referrers computed or shown meanwhile and redraw
+        the tree.
+
+        Existing children are kept, so are their expanded subtrees.
+
+        """
+        if self.children or (self.state == 'expanded'):
+            # remove the trailing "more" and placeholder children
+            while self.children and self.children[-1].item.is_trailer():
+                self.children.pop().destroy()
+            for item in self.item.get_items(len(self.children)):
+                self.children.append(self.__class__(self.canvas, self, item))
         self.update()
 
     def print_object(self):
@@ -45,22 +97,17 @@ class _TreeNode(TreeWidget.TreeNode):
     def drawtext(self):
         """Override drawtext from TreeWidget.TreeNode.
 
-        This seems to be a good place to add the popup menu.
+        This seems to be a good place to add the popup menu. All nodes share
+        the menu of the browser.
 
         """
         TreeWidget.TreeNode.drawtext(self)
-        # create a menu
-        menu = Tkinter.Menu(self.canvas, tearoff=0)
-        menu.add_command(label="reload referrers", command=self.reload_referrers)
-        menu.add_command(label="print", command=self.print_object)
-        menu.add_separator()
-        menu.add_command(label="expand", command=self.expand)
-        menu.add_separator()
-        # the popup only disappears when to click on it
-        menu.add_command(label="Close Popup Menu")
-        def do_popup(event):
-            menu.post(event.x_root, event.y_root)
-        self.label.bind("<Button-3>", do_popup)
+        if isinstance(self.item, _ReferrerTreeItem) and\
+           isinstance(self.item.node, refbrowser._Node):
+            menu = self.item.reftree._get_menu(self.canvas)
+            def do_popup(event):
+                menu.popup(self, event.x_root, event.y_root)
+            self.label.bind("<Button-3>", do_popup)
         # override, i.e. disable the editing of items
 
     # disable editing of TreeNodes
@@ -68,7 +115,61 @@ class _TreeNode(TreeWidget.TreeNode):
     def edit_finish(self, event=None): pass
     def edit_cancel(self, event=None): pass
 
-class _ReferrerTreeItem(TreeWidget.TreeItem, Tkinter.Label):
+class _PopupMenu(object):
+    """Context menu shared by all nodes of a tree."""
+
+    def __init__(self, canvas):
+        self.target = None
+        self.menu = Tkinter.Menu(canvas, tearoff=0)
+        self.menu.add_command(label="reload referrers",\
+                              command=self._command('reload_referrers'))
+        self.menu.add_command(label="cancel", command=self._command('cancel'))
+        self.menu.add_command(label="print",\
+                              command=self._command('print_object'))
+        self.menu.add_separator()
+        self.menu.add_command(label="expand", command=self._command('expand'))
+        self.menu.add_separator()
+        # the popup only disappears when to click on it
+        self.menu.add_command(label="Close Popup Menu")
+
+    def _command(self, name):
+        """Get a command which invokes a method of the current target."""
+        def command():
+            if self.target is not None:
+                getattr(self.target, name)()
+        return command
+
+    def popup(self, target, x, y):
+        """Show the menu for a _TreeNode at the given position."""
+        self.target = target
+        self.menu.post(x, y)
+
+class _MoreTreeItem(TreeWidget.TreeItem):
+    """Tree item which shows further children of a tree item when double-
+    clicked."""
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.treenode = None
+
+    def is_trailer(self):
+        return True
+
+    def GetText(self):
+        n = len(self.parent.node.children) - self.parent.shown
+        return "%s more (double-click to show)" % n
+
+    def GetIconName(self):
+        return "python"
+
+    def IsExpandable(self):
+        return False
+
+    def OnDoubleClick(self):
+        self.parent.shown += self.parent.reftree.page_size
+        self.parent.treenode.sync()
+
+class _ReferrerTreeItem(TreeWidget.TreeItem):
     """Tree item wrapper around refbrowser._Node object."""
 
     def __init__(self, parentwindow, node, reftree):
@@ -77,10 +178,23 @@ class _ReferrerTreeItem(TreeWidget.TreeItem, Tkinter.Label):
         belongs to.
 
         """
-        Tkinter.Label.__init__(self, parentwindow)
         self.node = node
         self.parentwindow = parentwindow
         self.reftree = reftree
+        # the _TreeNode displaying this item
+        self.treenode = None
+        # referrers have been computed or are being computed
+        self.loaded = False
+        self.pending = False
+        # incremented with each request and cancellation, so results of
+        # earlier requests can be told apart
+        self.generation = 0
+        # number of children shown, more are shown a page at a time
+        self.shown = reftree.page_size
+
+    def is_trailer(self):
+        """Check if this item is a placeholder shown after the children."""
+        return self.node is _LOADING
 
     def _clear_children(self):
         """Clear children list from any TreeNode instances.
@@ -120,31 +234,58 @@ class _ReferrerTreeItem(TreeWidget.TreeItem, Tkinter.Label):
                 return muppy._is_containerobject(self.node.o)
 
     def GetSubList(self):
-        """This method is the point where further referrers are computed.
+        """This method is the point where further referrers are requested.
 
-        Thus, the computation is done on-demand and only when needed.
+        Thus, the computation is done on-demand and only when needed. The
+        referrers are computed on a background thread. Until all of them
+        are available, a placeholder is shown after those available.
         
         """
-        sublist = []
-
-        children = self.node.children
-        if (len(children) == 0) and\
+        if (not self.loaded) and (not self.pending) and\
+           (len(self.node.children) == 0) and\
            (muppy._is_containerobject(self.node.o)):
-            self.node = self.reftree._get_tree(self.node.o, 1)
-            self._clear_children()
-            children = self.node.children
+            self.reftree._request(self)
+        return self.get_items(0)
+
+    def get_items(self, start):
+        """Get the items of the shown children from the index start on.
+
+        Only the first shown children get an item. If there are more, an
+        item which shows another page of them follows, and a placeholder if
+        referrers are still being computed.
 
-        for child in children:
+        """
+        sublist = []
+        for child in self.node.children[start:self.shown]:
             item = _ReferrerTreeItem(self.parentwindow, child, self.reftree)
             sublist.append(item)
+        if len(self.node.children) > self.shown:
+            sublist.append(_MoreTreeItem(self))
+        if self.pending:
+            sublist.append(_ReferrerTreeItem(self.parentwindow, _LOADING,\
+                                             self.reftree))
         return sublist
 
 class InteractiveBrowser(refbrowser.RefBrowser):
     """Interactive referrers browser.
 
     If you do not define str_func, default_str_function will be used.
+
+    Referrers are computed on a background thread, so that the window stays
+    responsive. The thread first builds a referrer index of all objects,
+    unless one was passed to the constructor, and then looks up referrers in
+    it. Expanded nodes show the referrers computed so far and a "loading..."
+    placeholder, until all referrers are available. Collapsing a node cancels
+    the computation.
     
     """
+    # milliseconds between two checks for computed referrers
+    poll_interval = 100
+    # number of referrers passed to the window at once
+    chunk_size = 100
+    # number of children shown at once
+    page_size = 100
+
     def main(self, standalone=False):
         """Create interactive browser window.
 
@@ -155,15 +296,107 @@ class InteractiveBrowser(refbrowser.RefBrowser):
         """
         if self.str_func == None:
             self.str_func = default_str_function
+        # requests from the window to the worker and results back
+        self._requests = Queue.Queue()
+        self._results = Queue.Queue()
+        self._current = None
+        self._menu = None
+        worker = threading.Thread(target=self._work,\
+                                  name="muppy.InteractiveBrowser")
+        worker.setDaemon(True)
+        worker.start()
         window = Tkinter.Tk()
         sc = TreeWidget.ScrolledCanvas(window, bg="white",\
                                        highlightthickness=0, takefocus=1)
         sc.frame.pack(expand=1, fill="both")
-        item = _ReferrerTreeItem(window, self.get_tree(), self)
+        item = _ReferrerTreeItem(window, refbrowser._Node(self.root,\
+                                                          self.str_func), self)
         node = _TreeNode(sc.canvas, None, item)
         node.expand()
+        window.after(self.poll_interval, self._poll, window)
         if standalone:
             window.mainloop()
+            self._requests.put(None)
+
+    def _get_menu(self, canvas):
+        """Get the context menu shared by all nodes."""
+        if self._menu is None:
+            self._menu = _PopupMenu(canvas)
+        return self._menu
+
+    def _request(self, item):
+        """Request the referrers of an item from the worker thread."""
+        item.pending = True
+        item.generation += 1
+        self._requests.put((item, item.generation))
+
+    def _cancel(self, item):
+        """Cancel a request, the referrers computed so far are kept."""
+        if item.pending:
+            item.generation += 1
+            item.pending = False
+            item.loaded = True
+
+    def _in_budget(self):
+        """Override _in_budget from refbrowser.RefBrowser.
+
+        Cancelled requests stop the computation as if a budget was exceeded.
+
+        """
+        if self._current is not None:
+            (item, generation) = self._current
+            if item.generation != generation:
+                self.truncated = 'cancelled'
+                return False
+        return refbrowser.RefBrowser._in_budget(self)
+
+    def _work(self):
+        """Main loop of the worker thread."""
+        if self.index is None:
+            self.index = refbrowser._ReferrerIndex()
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            (item, generation) = request
+            if item.generation != generation:
+                continue
+            self._current = request
+            try:
+                children = self._build(item.node.o, 1).children
+            finally:
+                self._current = None
+            for i in range(0, len(children), self.chunk_size):
+                if item.generation != generation:
+                    break
+                self._results.put((item, generation,\
+                                   children[i:i+self.chunk_size]))
+            self._results.put((item, generation, None))
+            children = request = None
+
+    def _poll(self, window):
+        """Pass computed referrers to their items and redraw them."""
+        changed = []
+        ids = set()
+        try:
+            while True:
+                (item, generation, children) = self._results.get_nowait()
+                if item.generation != generation:
+                    continue
+                if id(item) not in ids:
+                    changed.append(item)
+                    ids.add(id(item))
+                if children is None:
+                    item.pending = False
+                    item.loaded = True
+                else:
+                    item.node.children.extend(children)
+        except Queue.Empty:
+            pass
+        for item in changed:
+            if item.treenode is not None:
+                item.treenode.sync()
+        window.after(self.poll_interval, self._poll, window)
 
 def sample_interactive():
     l = [1,2,3,4,5]
@@ -43,10 +43,14 @@ e.g. the current line number of a frame, should not be included. You may add
 more detailed information at higher verbosity levels than 1.
 """
 
+import array
+import gc
 import re
 import string
 import types
 
+from math import frexp
+
 # default to asizeof if sys.getsizeof is not available (prior to Python 2.6)
 try:
     from sys import getsizeof as _getsizeof
@@ -54,6 +58,10 @@ except ImportError:
     from utils import asizeof
     _getsizeof = asizeof.flatsize
 
+# number of log2 size buckets kept in a histogram. The object sizes counted
+# in slot i are at least 2**(i-1) and less than 2**i bytes.
+HISTOGRAM_SLOTS = 64
+
 representations = {}
 def _init_representations():
     global representations
@@ -110,7 +118,9 @@ def _init_representations():
 
 _init_representations()
 
-def summarize(objects):
+def summarize(objects, histograms=None, max_rows=None, errors=None,
+              size_top=None, size_types=None, estimated=None, owners=False,
+              owner_attributes=False):
     """Summarize an objects list.
 
     Return a list of lists, whereas each row consists of::
@@ -118,22 +128,499 @@ def summarize(objects):
 
     No guarantee regarding the order is given.
 
+    Keyword arguments:
+    histograms -- if a dictionary is passed, it is filled with a size
+                  histogram for each row (see get_histogram_stats).
+    max_rows -- if not None, the summary will not contain more rows than
+                this. Rare types are then only approximated (see below).
+    errors -- if a dictionary is passed and max_rows is used, it is filled
+              with the approximation error of each row.
+    size_top -- number of most frequent types to size in a two-phase summary
+    size_types -- list of types to size in a two-phase summary
+    estimated -- if a set is passed, it is filled with the types of all
+                 rows whose total size was estimated in a two-phase summary
+    owners -- if True, dictionaries which are namespaces of instances,
+              classes, or modules are listed in separate rows per owner,
+              e.g. "dict (owned by ourapp.Session)"
+    owner_attributes -- if True and owners is True, lists, sets, and
+                        dictionaries referenced by these namespaces or by
+                        slots of instances are also listed per owner
+
+    With max_rows, summaries are computed with the Space-Saving algorithm.
+    If a new type is encountered and the summary is full, the row with the
+    fewest objects is replaced by the new type, which inherits its number of
+    objects and total size. Both the number of objects and the total size of
+    a row are therefore upper bounds. The approximation error is recorded
+    as a (number of objects, total size) tuple, which is (0, 0) for rows
+    that are exact. Types which are more frequent than
+    len(objects) / max_rows are always included.
+
+    If size_top or size_types is given, a two-phase summary is computed.
+    First, all objects are counted. Then only the objects of the size_top
+    most frequent types and of the types listed in size_types are sized.
+    The total size of all other rows is estimated from the mean size of
+    their objects, which is remembered from earlier summaries, or taken from
+    a single sample object. Histograms are only kept for sized rows.
+
+    Owners are identified with a single additional pass over all objects
+    which looks up the namespaces and slots of possible owners.
+
     """
+    owned = None
+    if owners:
+        owned = _get_owned(objects, owner_attributes)
+    if (size_top is not None) or (size_types is not None):
+        if max_rows is not None:
+            raise ValueError("max_rows cannot be combined with a two-phase"\
+                             " summary")
+        return _summarize_two_phase(objects, size_top, size_types,\
+                                    histograms, estimated, owned)
+    if max_rows is not None:
+        return _summarize_bounded(objects, max_rows, histograms, errors, owned)
     count = {}
     total_size = {}
     for o in objects:
-        otype = _repr(o)
+        if (owned is not None) and (id(o) in owned):
+            otype = owned[id(o)]
+        else:
+            otype = _repr(o)
+        size = _getsizeof(o)
         if otype in count:
             count[otype] += 1
-            total_size[otype] += _getsizeof(o)
+            total_size[otype] += size
         else:
             count[otype] = 1
-            total_size[otype] = _getsizeof(o)
+            total_size[otype] = size
+        if histograms is not None:
+            if otype not in histograms:
+                histograms[otype] = array.array('l', [0]) * HISTOGRAM_SLOTS
+            histograms[otype][frexp(size)[1]] += 1
     rows = []
     for otype in count:
         rows.append([otype, count[otype], total_size[otype]])
     return rows
 
+def _summarize_bounded(objects, max_rows, histograms, errors, owned=None):
+    """Summarize an objects list with at most max_rows rows.
+
+    See summarize for a description of the arguments.
+
+    """
+    if max_rows < 1:
+        raise ValueError("max_rows must be at least 1")
+    if errors is None:
+        errors = {}
+    rows = {}
+    # rows with the same number of objects, indexed by this number. This
+    # allows to find a row with the fewest objects in constant time.
+    buckets = {}
+    min_count = 0
+    for o in objects:
+        if (owned is not None) and (id(o) in owned):
+            otype = owned[id(o)]
+        else:
+            otype = _repr(o)
+        size = _getsizeof(o)
+        if otype in rows:
+            row = rows[otype]
+        elif len(rows) < max_rows:
+            row = rows[otype] = [otype, 0, 0]
+            errors[otype] = (0, 0)
+            buckets.setdefault(0, set()).add(otype)
+            min_count = 0
+        else:
+            # replace a row with the fewest objects
+            evicted = buckets[min_count].pop()
+            row = rows.pop(evicted)
+            del errors[evicted]
+            errors[otype] = (row[1], row[2])
+            if histograms is not None:
+                histograms[otype] = histograms.pop(evicted)
+            buckets[min_count].add(otype)
+            row[0] = otype
+            rows[otype] = row
+        # move the row to the next bucket
+        bucket = buckets[row[1]]
+        bucket.discard(otype)
+        if (len(bucket) == 0):
+            del buckets[row[1]]
+            if row[1] == min_count:
+                min_count += 1
+        row[1] += 1
+        row[2] += size
+        buckets.setdefault(row[1], set()).add(otype)
+        if histograms is not None:
+            if otype not in histograms:
+                histograms[otype] = array.array('l', [0]) * HISTOGRAM_SLOTS
+            histograms[otype][frexp(size)[1]] += 1
+    return rows.values()
+
+# type flag of classes defined in Python code (heap types)
+__TPFLAGS_HEAPTYPE = 1<<9
+
+def _get_owned(objects, attributes=False):
+    """Get the owner of all namespace dictionaries in an objects list.
+
+    Return a dictionary which maps the id of each dictionary owned by an
+    instance, class, or module to its representation including the owner,
+    e.g. "dict (owned by ourapp.Session)". If attributes is True, lists,
+    sets, and dictionaries referenced by slots and namespaces are included.
+
+    Only the namespace (__dict__) of an owner is accounted to it, not any
+    other dictionary it refers to, e.g. the values of a dict subclass.
+
+    What kind of owner an object can be is determined once per type.
+
+    """
+    kinds = {}
+    slots = {}
+    class_names = {}
+    res = {}
+    def own(r, kind):
+        if (type(r) in (list, set, dict)) and (id(r) not in res):
+            res[id(r)] = "%s (owned by %s)" % (_repr(r), kind)
+    for o in objects:
+        t = type(o)
+        if t in kinds:
+            kind = kinds[t]
+        else:
+            if t is types.ModuleType:
+                kind = 'module'
+            elif (t is types.ClassType) or issubclass(t, type):
+                kind = 'class'
+            elif (t is types.InstanceType) or\
+                 (t.__flags__ & __TPFLAGS_HEAPTYPE):
+                kind = None
+                slots[t] = _get_slots(t)
+            else:
+                kind = False
+            kinds[t] = kind
+        if kind is False:
+            continue
+        namespace = _get_namespace(o)
+        if kind is None:
+            # instances are charged to their class
+            cls = o.__class__
+            if cls in class_names:
+                kind = class_names[cls]
+            else:
+                kind = class_names[cls] = "%s.%s" % (_get_module(cls),\
+                                                     cls.__name__)
+            if attributes:
+                for descriptor in slots[t]:
+                    try:
+                        own(descriptor.__get__(o, t), kind)
+                    except AttributeError:
+                        # unset slot
+                        pass
+        if (type(namespace) is dict) and (id(namespace) not in res):
+            own(namespace, kind)
+            if attributes:
+                for v in namespace.itervalues():
+                    own(v, kind)
+    return res
+
+def _get_namespace(o):
+    """Get the namespace dictionary of an object or None.
+
+    The namespace of a class is its dictionary, not the proxy returned by
+    its __dict__ attribute. __getattr__ methods of instances are bypassed.
+
+    """
+    try:
+        if type(o) in (types.InstanceType, types.ClassType):
+            namespace = o.__dict__
+        else:
+            namespace = object.__getattribute__(o, '__dict__')
+    except AttributeError:
+        return None
+    if type(namespace) is types.DictProxyType:
+        # the proxy refers to the dictionary of the class only
+        namespace = gc.get_referents(namespace)[0]
+    return namespace
+
+def _get_slots(t):
+    """Get the descriptors of all slots of instances of type t."""
+    res = []
+    for cls in getattr(t, '__mro__', ()):
+        for v in cls.__dict__.itervalues():
+            if type(v) is types.MemberDescriptorType:
+                res.append(v)
+    return res
+
+# mean object size of each row of a two-phase summary, indexed by type
+_mean_sizes = {}
+
+def _summarize_two_phase(objects, size_top, size_types, histograms,
+                         estimated, owned=None):
+    """Summarize an objects list, but size only the objects of some types.
+
+    See summarize for a description of the arguments.
+
+    """
+    # first phase: count objects. Types without a special representation
+    # are represented the same way for all their objects.
+    labels = []
+    count = {}
+    samples = {}
+    type_labels = {}
+    for o in objects:
+        t = type(o)
+        if (owned is not None) and (id(o) in owned):
+            otype = owned[id(o)]
+        elif t in type_labels:
+            otype = type_labels[t]
+        else:
+            otype = _repr(o)
+            if t not in representations:
+                type_labels[t] = otype
+        labels.append(otype)
+        if otype in count:
+            count[otype] += 1
+        else:
+            count[otype] = 1
+            samples[otype] = o
+    # pick the types to size
+    sized = set()
+    if size_top is not None:
+        by_count = count.keys()
+        by_count.sort(lambda t1, t2: count[t2] - count[t1])
+        sized.update(by_count[:size_top])
+    if size_types is not None:
+        for otype, o in samples.items():
+            if type(o) in size_types:
+                sized.add(otype)
+    # second phase: size the objects of these types
+    total_size = {}
+    i = 0
+    for o in objects:
+        otype = labels[i]
+        i += 1
+        if otype not in sized:
+            continue
+        size = _getsizeof(o)
+        if otype in total_size:
+            total_size[otype] += size
+        else:
+            total_size[otype] = size
+        if histograms is not None:
+            if otype not in histograms:
+                histograms[otype] = array.array('l', [0]) * HISTOGRAM_SLOTS
+            histograms[otype][frexp(size)[1]] += 1
+    rows = []
+    for otype in count:
+        if otype in sized:
+            _mean_sizes[otype] = float(total_size[otype]) / count[otype]
+        else:
+            if otype not in _mean_sizes:
+                _mean_sizes[otype] = _getsizeof(samples[otype])
+            total_size[otype] = int(round(_mean_sizes[otype] * count[otype]))
+            if estimated is not None:
+                estimated.add(otype)
+        rows.append([otype, count[otype], total_size[otype]])
+    return rows
+
+def rollup(objects):
+    """Summarize an objects list grouped by the module defining each type.
+
+    Return a dictionary which maps module names to summaries. Each summary
+    lists only objects whose type is defined in the respective module. For
+    instances of old-style classes the class is used instead of the type.
+
+    The defining module is looked up once per type, not once per object.
+
+    """
+    modules = {}
+    res = {}
+    for o in objects:
+        t = type(o)
+        if t is types.InstanceType:
+            t = o.__class__
+        if t in modules:
+            rows = modules[t]
+        else:
+            module = _get_module(t)
+            if module not in res:
+                res[module] = {}
+            rows = modules[t] = res[module]
+        otype = _repr(o)
+        if otype in rows:
+            row = rows[otype]
+            row[1] += 1
+            row[2] += _getsizeof(o)
+        else:
+            rows[otype] = [otype, 1, _getsizeof(o)]
+    for module in res:
+        res[module] = res[module].values()
+    return res
+
+def get_package_totals(rolled_up, level=1, package=None):
+    """Get per-package subtotals of a rollup.
+
+    Return a summary in which the first column is a package name instead of
+    a type. Module names are truncated to their first `level` components,
+    e.g. with level 1 the modules 'ourapp.cache' and 'ourapp.db' are both
+    accounted to 'ourapp'.
+
+    Keyword arguments:
+    level -- number of leading name components which define a package
+    package -- if not None, only modules within this package are considered.
+               Use it together with a higher level to drill down.
+
+    """
+    totals = {}
+    for module, rows in rolled_up.items():
+        if (package is not None) and not _in_package(module, package):
+            continue
+        name = '.'.join(module.split('.')[:level])
+        if name not in totals:
+            totals[name] = [name, 0, 0]
+        for row in rows:
+            totals[name][1] += row[1]
+            totals[name][2] += row[2]
+    return totals.values()
+
+def get_package_summary(rolled_up, package):
+    """Get a summary of all objects whose type is defined in a package.
+
+    Rows of different modules within the package are merged by type.
+
+    """
+    merged = {}
+    for module, rows in rolled_up.items():
+        if not _in_package(module, package):
+            continue
+        for row in rows:
+            if row[0] in merged:
+                merged[row[0]][1] += row[1]
+                merged[row[0]][2] += row[2]
+            else:
+                merged[row[0]] = [row[0], row[1], row[2]]
+    return merged.values()
+
+def get_type_graph(objects):
+    """Get the references between the types of an objects list.
+
+    Return a list of rows [source type, target type, # references, total
+    size], one for each pair of types with at least one reference from an
+    object of the source type to an object of the target type. The total
+    size is the sum of the sizes of the referenced objects, counted once
+    per reference. Types are represented as in summaries.
+
+    All referents are looked up in a single pass over the objects list, thus
+    this is a lot cheaper than calling gc.get_referrers() for each object of
+    interest.
+
+    """
+    # labels of types which have no special representation, looked up once
+    # per type
+    labels = {}
+    def label(o):
+        t = type(o)
+        if t in labels:
+            return labels[t]
+        if t in representations:
+            return _repr(o)
+        res = labels[t] = _repr_type(t)
+        return res
+    edges = {}
+    for o in objects:
+        source = label(o)
+        for ref in gc.get_referents(o):
+            key = (source, label(ref))
+            if key in edges:
+                edge = edges[key]
+                edge[2] += 1
+                edge[3] += _getsizeof(ref)
+            else:
+                edges[key] = [key[0], key[1], 1, _getsizeof(ref)]
+    return edges.values()
+
+def print_type_graph(rows, limit=15, sort='size', target=None):
+    """Print the rows of a type graph, ranked in descending order.
+
+    Keyword arguments:
+    limit -- the maximum number of references to be listed
+    sort -- rank references by 'size' or '#'
+    target -- if not None, only references to this type are listed, e.g.
+              'tuple' shows which types hold tuples
+    """
+    sortby = {'#': 2, 'size': 3}
+    if sort not in sortby:
+        raise ValueError("invalid sort, should be one of" + str(sortby.keys()))
+    rows = _rank_type_graph(rows, sortby[sort], target)[0:limit]
+    rows.insert(0, ["referrer types", "referent types", "# references",\
+                    "total size"])
+    _print_table(rows)
+
+def write_type_graph(rows, out, limit=None, sort='size', target=None):
+    """Write the rows of a type graph to out in the DOT format of Graphviz.
+
+    Edges point from the referring type to the referenced type and are
+    labeled with the number of references and the total size.
+
+    Keyword arguments:
+    out -- a file-like object to write to
+    limit -- if not None, the maximum number of references to be written
+    sort -- prefer references with the highest 'size' or '#' if limited
+    target -- if not None, only references to this type are written
+    """
+    sortby = {'#': 2, 'size': 3}
+    if sort not in sortby:
+        raise ValueError("invalid sort, should be one of" + str(sortby.keys()))
+    rows = _rank_type_graph(rows, sortby[sort], target)
+    if limit is not None:
+        rows = rows[0:limit]
+    out.write('digraph types {\n')
+    for row in rows:
+        out.write('  "%s" -> "%s" [label="%s refs, %s bytes"];\n' %\
+                  (_dot_escape(row[0]), _dot_escape(row[1]), row[2], row[3]))
+    out.write('}\n')
+
+def _rank_type_graph(rows, column, target=None):
+    """Get the rows of a type graph in descending order of a column,
+    optionally only those referring to the target type."""
+    if target is not None:
+        rows = [row for row in rows if row[1] == target]
+    else:
+        rows = list(rows)
+    rows.sort(lambda r1, r2: r2[column] - r1[column])
+    return rows
+
+def _dot_escape(s):
+    """Escape a string for use in a quoted DOT label."""
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def get_percentile(histogram, percent):
+    """Get the size below which percent of the objects of a histogram are.
+
+    Because sizes are counted in log2 buckets, the result is the upper bound
+    of the bucket the percentile falls into, i.e. at most twice the exact
+    value.
+
+    """
+    total = 0
+    for n in histogram:
+        total += n
+    if total == 0:
+        return 0
+    threshold = total * percent / 100.0
+    seen = 0
+    for i in range(len(histogram)):
+        seen += histogram[i]
+        if (histogram[i] > 0) and (seen >= threshold):
+            return 2**i - 1
+    return 2**(len(histogram) - 1) - 1
+
+def get_histogram_stats(histogram):
+    """Get the (p50, p99, max) object sizes of a size histogram.
+
+    See get_percentile for the accuracy of these values.
+
+    """
+    return (get_percentile(histogram, 50), get_percentile(histogram, 99),
+            get_percentile(histogram, 100))
+
 def get_diff(left, right):
     """Get the difference of two summaries.
 
@@ -147,21 +634,21 @@ def get_diff(left, right):
 
     """
     res = []
+    # index rows by type, so each row is looked up only once
+    left_rows = {}
+    for row_l in left:
+        left_rows[row_l[0]] = row_l
+    right_types = set()
     for row_r in right:
-        found = False
-        for row_l in left:
-            if row_r[0] == row_l[0]:
-                res.append([row_r[0], row_r[1] - row_l[1], row_r[2] - row_l[2]])
-                found = True
-        if not found:
+        right_types.add(row_r[0])
+        if row_r[0] in left_rows:
+            row_l = left_rows[row_r[0]]
+            res.append([row_r[0], row_r[1] - row_l[1], row_r[2] - row_l[2]])
+        else:
             res.append(row_r)
 
     for row_l in left:
-        found = False
-        for row_r in right:
-            if row_l[0] == row_r[0]:
-                found = True
-        if not found:
+        if row_l[0] not in right_types:
             res.append([row_l[0], -row_l[1], -row_l[2]])
     return res
 
@@ -257,7 +744,29 @@ def _repr(o, verbosity=1):
     res = type_suffix.sub('', res)
         
     return res
-            
+
+def _repr_type(t):
+    """Get the representation of type t, as _repr uses it for objects of
+    types without a special representation.
+
+    """
+    res = str(t)
+    res = address.sub('', res)
+    res = type_prefix.sub('', res)
+    res = type_suffix.sub('', res)
+    return res
+
+def _get_module(t):
+    """Get the name of the module which defines type (or class) t."""
+    module = getattr(t, '__module__', None)
+    if not isinstance(module, str):
+        module = '__builtin__'
+    return module
+
+def _in_package(module, package):
+    """Is the module the package itself or contained in the package."""
+    return (module == package) or module.startswith(package + '.')
+
 def _traverse(summary, function, *args):
     """Traverse all objects of a summary and call function with each as a
     parameter.
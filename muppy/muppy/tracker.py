@@ -5,16 +5,139 @@ Using the SummaryTracker, you can create summaries and compare them
 with each other. Stored summaries can be ignored during comparision,
 avoiding the observer effect.
 
+The BackgroundTracker takes summaries periodically in a background thread
+and keeps the most recent ones. A SummaryHistory keeps summaries of long
+running processes at decreasing resolutions within a fixed amount of memory.
+Rules, such as a GrowthRule or a TotalSizeRule, can be added to a
+BackgroundTracker to invoke callbacks when thresholds are exceeded.
+
 The ObjectTracker allows to monitor object creation. You create objects from
-one time and compare with objects from an earlier time.
+one time and compare with objects from an earlier time. The WeakObjectTracker
+does the same without keeping the objects alive.
+
+The ClassTracker counts the instances of selected classes when they are
+created and released, without walking the heap at all.
 
 """
-import gc
+import array
+import collections
 import inspect
+import itertools
 import sys
+import threading
+import time
+import traceback
+import types
+import weakref
+from math import frexp
+from UserDict import DictMixin
 
 import muppy
 import summary
+from muppy import _getsizeof
+from utils import asizeof
+
+class _SummaryStore(DictMixin):
+    """Dictionary-like storage which keeps summaries in packed form.
+
+    Stored summaries should influence the observed application as little as
+    possible. Therefore, rows are not kept as lists of Python objects, but as
+    (type index, number of objects, total size) triples in a single array.
+    The type representations are stored once in a single string, each
+    terminated by a null character. Apart from the keys, only a constant
+    number of objects is used, no matter how many summaries are stored.
+
+    Summaries are unpacked whenever they are accessed. Type representations
+    no longer used by any summary are dropped when a summary is deleted.
+
+    """
+    def __init__(self):
+        self._keys = []
+        # null-terminated type representations
+        self._types = ''
+        # (type index, number of objects, total size) of all rows
+        self._rows = array.array('l')
+        # index in self._rows at which the summary of each key starts, with
+        # a last entry marking the end
+        self._offsets = array.array('l', [0])
+
+    def _get_objects(self):
+        """Get all objects used by the store itself, except for keys."""
+        return [self, self.__dict__, self._keys, self._types, self._rows,\
+                self._offsets]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return self._keys[:]
+
+    def _index(self, key):
+        try:
+            return self._keys.index(key)
+        except ValueError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        i = self._index(key)
+        types = self._types.split('\0')
+        rows = self._rows
+        res = []
+        for j in range(self._offsets[i], self._offsets[i+1], 3):
+            res.append([types[rows[j]], rows[j+1], rows[j+2]])
+        return res
+
+    def __setitem__(self, key, value):
+        if key in self._keys:
+            del self[key]
+        # index of each type representation already stored
+        types = self._types.split('\0')[:-1]
+        indices = dict(zip(types, range(len(types))))
+        new_types = []
+        rows = array.array('l')
+        for row in value:
+            if row[0] not in indices:
+                indices[row[0]] = len(indices)
+                new_types.append(row[0] + '\0')
+            rows.extend([indices[row[0]], row[1], row[2]])
+        self._types += ''.join(new_types)
+        self._rows.extend(rows)
+        self._offsets.append(len(self._rows))
+        self._keys.append(key)
+
+    def __delitem__(self, key):
+        i = self._index(key)
+        (start, end) = (self._offsets[i], self._offsets[i+1])
+        del self._rows[start:end]
+        del self._offsets[i+1]
+        for j in range(i+1, len(self._offsets)):
+            self._offsets[j] -= end - start
+        del self._keys[i]
+        self._prune()
+
+    def _prune(self):
+        """Drop type representations which are no longer used."""
+        rows = self._rows
+        used = set(rows[0::3])
+        types = self._types.split('\0')[:-1]
+        if len(used) == len(types):
+            return
+        # new index of each type representation still in use
+        indices = array.array('l', [-1]) * len(types)
+        kept = []
+        for j in range(len(types)):
+            if j in used:
+                indices[j] = len(kept)
+                kept.append(types[j] + '\0')
+        for j in range(0, len(rows), 3):
+            rows[j] = indices[rows[j]]
+        self._types = ''.join(kept)
 
 class SummaryTracker(object):
     """ Helper class to track changes between two summaries taken.
@@ -27,23 +150,26 @@ class SummaryTracker(object):
     a new summary will be created. Thus, a diff between the new and the last
     summary can be extracted.
 
-    Be aware that filtering out previous summaries is time-intensive. You should
-    therefore restrict yourself to the number of summaries you really need.
+    Stored summaries are kept in a packed form which consists of only a few
+    objects (see _SummaryStore), which are excluded from new summaries by
+    their identity.
 
     """
-    def __init__(self, ignore_self=True):
+    def __init__(self, ignore_self=True, baseline=True):
         """Constructor.
 
-        The number of summaries managed by the tracker has an performance
-        impact on new summaries, iff you decide to exclude them from further
-        summaries. Therefore it is suggested to use them economically.
-        
         Keyword arguments:
         ignore_self -- summaries managed by this object will be ignored.
+        baseline -- if False, no first summary is taken and the first diff
+                    lists all objects
         """
-        self.s0 = summary.summarize(muppy.get_objects())
-        self.summaries = {}
+        self.s0 = []
+        if baseline:
+            self.s0 = summary.summarize(muppy.get_objects())
+        self.summaries = _SummaryStore()
         self.ignore_self = ignore_self
+        # further stores whose objects are ignored, such as a SummaryHistory
+        self._stores = []
 
     def create_summary(self):
         """Return a summary.
@@ -56,48 +182,14 @@ class SummaryTracker(object):
             res = summary.summarize(muppy.get_objects())
         else:
             # If the user requested the data required to store summaries to be
-            # ignored in the summaries, we need to identify all objects which
-            # are related to each summary stored.
-            # Thus we build a list of all objects used for summary storage as
-            # well as a dictionary which tells us how often an object is
-            # referenced by the summaries.
-            # During this identification process, more objects are referenced,
-            # namely int objects identifying referenced objects as well as the
-            # correspondind count.
-            # For all these objects it will be checked wether they are
-            # referenced from outside the monitor's scope. If not, they will be
-            # subtracted from the snapshot summary, otherwise they are
-            # included (as this indicates that they are relevant to the
-            # application). 
-
-            all_of_them = []  # every single object
-            ref_counter = {}  # how often it is referenced; (id(o), o) pairs
-            def store_info(o):
-                all_of_them.append(o)
-                if id(o) in ref_counter:
-                    ref_counter[id(o)] += 1
-                else:
-                    ref_counter[id(o)] = 1
-
-            # store infos on every single object related to the summaries
-            store_info(self.summaries)
-            for k, v in self.summaries.items():
-                store_info(k)
-                summary._traverse(v, store_info)
-
-            # do the summary
-            res = summary.summarize(muppy.get_objects())
-
-            # remove ids stored in the ref_counter
-            for _id in ref_counter.keys():
-                # referenced in frame, ref_counter, ref_counter.keys()
-                if len(gc.get_referrers(_id)) == (3):
-                    summary._subtract(res, _id)
-            for o in all_of_them:
-                # referenced in frame, summary, all_of_them
-                if len(gc.get_referrers(o)) == (ref_counter[id(o)] + 2):
-                    summary._subtract(res, o)
-            
+            # ignored in the summaries, we exclude all objects used for
+            # summary storage by their identity. These objects are identified
+            # after all objects have been gathered, so that the bookkeeping
+            # done here is not part of the summary itself.
+            objects = muppy.get_objects()
+            ignore = self._get_owned_ids()
+            res = summary.summarize([o for o in objects\
+                                     if id(o) not in ignore])
         return res
     
     def diff(self, summary1=None, summary2=None):
@@ -134,10 +226,647 @@ class SummaryTracker(object):
         """
         summary.print_(self.diff(summary1=summary1, summary2=summary2))
 
+    def _get_owned_ids(self):
+        """Get the ids of all objects used to store summaries.
+
+        Keys of stored summaries are provided by the application and not
+        considered owned.
+
+        """
+        objects = self.summaries._get_objects()
+        objects.append(self._stores)
+        for store in self._stores:
+            objects.extend(store._get_objects())
+        return set([id(o) for o in objects])
+
     def store_summary(self, key):
         """Store a current summary in self.summaries."""
         self.summaries[key] = self.create_summary()
 
+
+class BackgroundTracker(object):
+    """Helper class which takes summaries periodically in the background.
+
+    Summaries are taken every `interval` seconds on a daemon thread. Only the
+    most recent `size` summaries are kept, older ones are dropped. Samples
+    are indexed like a list, from the oldest (0) to the latest (-1).
+
+    Summaries are taken and stored with a SummaryTracker, so stored
+    summaries are not included in new ones if ignore_self is True.
+
+    If an overhead budget is defined, the time between two summaries is
+    adapted to the time it takes to create a summary, so that the tracker
+    never uses more than this fraction of the wall time. While the total
+    size of all objects grows, summaries are taken as often as the budget
+    allows. Otherwise, the tracker backs off to the configured interval
+    again. See get_overhead for the measured overhead.
+
+    Rules added with add_rule are checked against each new summary.
+
+    """
+    def __init__(self, interval=60, size=60, ignore_self=True, budget=None,
+                 min_interval=1, growth=0.05, history=None):
+        """Constructor.
+
+        Keyword arguments:
+        interval -- seconds between two summaries
+        size -- maximum number of summaries to keep
+        ignore_self -- summaries managed by this object will be ignored.
+        budget -- maximum fraction of wall time spent on summaries, e.g. 0.01
+        min_interval -- minimum seconds between two summaries with a budget
+        growth -- relative growth of the total size between two summaries
+                  from which on summaries are taken faster (with a budget)
+        history -- SummaryHistory to which each summary is added
+        """
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        if (budget is not None) and not (0 < budget <= 1):
+            raise ValueError("budget must be greater 0 and at most 1")
+        self.interval = interval
+        self.size = size
+        self.budget = budget
+        self.min_interval = min_interval
+        self.growth = growth
+        self.history = history
+        # the interval currently used, adapted to the budget
+        self.current_interval = interval
+        self._created = time.time()
+        self._sampling_time = 0.0
+        self._last_duration = 0.0
+        self._last_total = None
+        self._tracker = SummaryTracker(ignore_self=ignore_self,\
+                                       baseline=False)
+        if history is not None:
+            self._tracker._stores.append(history)
+        # the time each slot of the ring was sampled
+        self._times = array.array('d', [0.0]) * size
+        # number of samples taken so far
+        self._count = 0
+        self._rules = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start taking summaries in the background."""
+        if self._thread is not None:
+            raise RuntimeError("tracker is already running")
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run,\
+                                        name="muppy.BackgroundTracker")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop taking summaries and wait for the background thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopped.set()
+        thread.join()
+        self._thread = None
+
+    def _run(self):
+        """Main loop of the background thread."""
+        try:
+            while not self._stopped.isSet():
+                self.sample()
+                self._stopped.wait(self.current_interval)
+        finally:
+            # the tracker can be started again if the thread died
+            if self._thread is threading.currentThread():
+                self._thread = None
+
+    def sample(self):
+        """Take a summary now and store it, dropping the oldest if needed.
+
+        Return the new summary.
+
+        """
+        start = time.time()
+        s = self._tracker.create_summary()
+        total = 0
+        for row in s:
+            total += row[2]
+        self._lock.acquire()
+        try:
+            # the slot is used as the key, so keys are reused as well
+            slot = self._count % self.size
+            self._tracker.summaries[slot] = s
+            self._times[slot] = time.time()
+            self._count += 1
+            if self.history is not None:
+                self.history.add(s, self._times[slot])
+            duration = time.time() - start
+            self._sampling_time += duration
+            self._last_duration = duration
+            growing = (self._last_total is not None) and\
+                      (total > self._last_total * (1 + self.growth))
+            self._last_total = total
+            if self.budget is not None:
+                self._adapt(duration, growing)
+            t = self._times[slot]
+            rules = self._rules[:]
+        finally:
+            self._lock.release()
+        # callbacks may use the tracker, so rules are checked without the lock
+        # a failing callback is reported, but does not stop the others
+        if rules:
+            rows = dict([(row[0], row) for row in s])
+            for rule in rules:
+                try:
+                    rule.check(t, s, rows, total)
+                except Exception:
+                    traceback.print_exc()
+        return s
+
+    def add_rule(self, rule):
+        """Add a rule which is checked against each new summary."""
+        self._lock.acquire()
+        try:
+            self._rules.append(rule)
+        finally:
+            self._lock.release()
+
+    def remove_rule(self, rule):
+        """Remove a rule added before."""
+        self._lock.acquire()
+        try:
+            self._rules.remove(rule)
+        finally:
+            self._lock.release()
+
+    def _adapt(self, duration, growing):
+        """Adapt the current interval to the duration of the last summary.
+
+        The time between two summaries must be at least duration / budget to
+        keep the overhead within the budget.
+
+        """
+        required = max(duration / self.budget - duration, self.min_interval)
+        if growing:
+            self.current_interval = required
+        else:
+            # back off to the configured interval
+            interval = min(self.current_interval * 2, self.interval)
+            self.current_interval = max(interval, required)
+
+    def get_overhead(self):
+        """Get metrics on the overhead caused by this tracker.
+
+        Return a dictionary with the following entries:
+        samples -- number of summaries taken so far
+        sampling_time -- seconds spent taking summaries
+        elapsed -- seconds since the tracker was created
+        overhead -- fraction of the elapsed time spent taking summaries
+        last_duration -- seconds it took to take the latest summary
+        interval -- seconds currently waited between two summaries
+
+        """
+        self._lock.acquire()
+        try:
+            elapsed = time.time() - self._created
+            overhead = 0.0
+            if elapsed > 0:
+                overhead = self._sampling_time / elapsed
+            return {'samples': self._count,
+                    'sampling_time': self._sampling_time,
+                    'elapsed': elapsed,
+                    'overhead': overhead,
+                    'last_duration': self._last_duration,
+                    'interval': self.current_interval}
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    def _get_slot(self, index):
+        """Get the ring slot of a sample index."""
+        n = len(self)
+        if index < 0:
+            index += n
+        if not (0 <= index < n):
+            raise IndexError("sample index out of range")
+        return (self._count - n + index) % self.size
+
+    def get(self, index):
+        """Get a (time, summary) tuple of a sample.
+
+        Samples are indexed from the oldest (0) to the latest (-1).
+
+        """
+        return self._get_samples([index])[0]
+
+    def _get_samples(self, indices=None):
+        """Get the (time, summary) tuples of several samples at once.
+
+        All samples are looked up under a single lock acquisition, so a
+        summary taken in the meantime cannot shift the indices. Per default,
+        all kept samples are returned.
+
+        """
+        self._lock.acquire()
+        try:
+            if indices is None:
+                indices = range(len(self))
+            slots = [self._get_slot(index) for index in indices]
+            return [(self._times[slot], self._tracker.summaries[slot])\
+                    for slot in slots]
+        finally:
+            self._lock.release()
+
+    def latest(self):
+        """Get the latest summary or None if none was taken yet."""
+        if len(self) == 0:
+            return None
+        return self.get(-1)[1]
+
+    def diff(self, a=-2, b=-1):
+        """Compute the diff between the samples with the indices a and b.
+
+        Per default, the diff between the two latest samples is returned.
+
+        """
+        ((ta, sa), (tb, sb)) = self._get_samples([a, b])
+        return summary._sweep(summary.get_diff(sa, sb))
+
+    def trend(self):
+        """Get the growth rate of each type over all kept samples.
+
+        Return a summary-like list of lists, whereas each row consists of::
+          [str(type), objects per second, bytes per second].
+
+        The rates are the slope of a least squares fit over all samples in
+        which the type appears. Types that do not appear in a sample are
+        treated as having no objects at that time.
+
+        """
+        samples = self._get_samples()
+        if len(samples) < 2:
+            return []
+        t0 = samples[0][0]
+        times = [t - t0 for (t, s) in samples]
+        mean_time = sum(times) / len(times)
+        variance = sum([(t - mean_time)**2 for t in times])
+        if variance == 0:
+            return []
+        # sum of each type's count and size over time, and their products
+        # with the deviation from the mean time
+        rows = {}
+        for i in range(len(samples)):
+            deviation = times[i] - mean_time
+            for row in samples[i][1]:
+                if row[0] not in rows:
+                    rows[row[0]] = [row[0], 0.0, 0.0]
+                rows[row[0]][1] += deviation * row[1]
+                rows[row[0]][2] += deviation * row[2]
+        # since the deviations add up to 0, missing samples contribute nothing
+        res = []
+        for row in rows.itervalues():
+            res.append([row[0], row[1] / variance, row[2] / variance])
+        return res
+
+
+
+class GrowthRule(object):
+    """Rule which fires if a type grows by more than a number of objects or
+    bytes within a time window.
+
+    Only the count and size of the watched type are kept for the samples
+    within the window, so checking a rule costs about the same, no matter
+    how many samples were taken. After the rule fired, the window starts
+    anew, so the rule fires again only if the type keeps growing.
+
+    """
+    def __init__(self, label, callback, objects=None, size=None, window=60):
+        """Constructor.
+
+        Keyword arguments:
+        label -- the type representation used in summaries, or a type
+                 which has no special representation (see
+                 summary.representations)
+        callback -- called with the rule and the summary if the rule fires
+        objects -- number of objects by which the type may grow
+        size -- number of bytes by which the type may grow
+        window -- seconds over which the growth is measured
+        """
+        if (objects is None) and (size is None):
+            raise ValueError("objects or size must be specified")
+        if not isinstance(label, str):
+            # the representation of these depends on each object, thus a
+            # single label cannot be derived from the type. Summaries
+            # represent dicts, lists, and sets by their type only.
+            if (type(label) is types.ClassType) or\
+               ((label in summary.representations) and\
+                (label not in (dict, list, set))):
+                raise ValueError("%s has a special representation, pass the"\
+                                 " label used in summaries" % label)
+            label = summary._repr_type(label)
+        self.label = label
+        self.callback = callback
+        self.objects = objects
+        self.size = size
+        self.window = window
+        # (time, count, size) of the samples within the window
+        self._samples = collections.deque()
+
+    def check(self, t, s, rows, total):
+        """Check the rule against a new summary.
+
+        Keyword arguments:
+        t -- the time the summary was taken
+        s -- the summary
+        rows -- the rows of the summary indexed by their type representation
+        total -- the total size of all objects in the summary
+        """
+        count = size = 0
+        if self.label in rows:
+            (count, size) = rows[self.label][1:3]
+        samples = self._samples
+        samples.append((t, count, size))
+        while samples[0][0] < t - self.window:
+            samples.popleft()
+        (t0, count0, size0) = samples[0]
+        if ((self.objects is not None) and (count - count0 > self.objects)) or\
+           ((self.size is not None) and (size - size0 > self.size)):
+            samples.clear()
+            samples.append((t, count, size))
+            self.callback(self, s)
+
+
+class TotalSizeRule(object):
+    """Rule which fires if the total size of all objects exceeds a limit.
+
+    The rule fires once when the limit is exceeded and again only after the
+    total size dropped below the limit in between.
+
+    """
+    def __init__(self, limit, callback):
+        """Constructor.
+
+        Keyword arguments:
+        limit -- the number of bytes the total size may not exceed
+        callback -- called with the rule and the summary if the rule fires
+        """
+        self.limit = limit
+        self.callback = callback
+        self._exceeded = False
+
+    def check(self, t, s, rows, total):
+        """Check the rule against a new summary.
+
+        See GrowthRule.check for the arguments.
+        """
+        if total <= self.limit:
+            self._exceeded = False
+        elif not self._exceeded:
+            self._exceeded = True
+            self.callback(self, s)
+
+
+class SummaryHistory(object):
+    """Round-robin history of summaries.
+
+    The history consists of several archives, each keeping a fixed number of
+    entries. The first archive keeps every summary added. All further
+    archives merge the summaries added within `step` seconds into a single
+    entry. When an archive is full, its oldest entry is dropped. Thus, the
+    memory used is independent of how long the history is in use.
+
+    Each entry is a (time, number of summaries, rows) tuple. The time is the
+    start of the step. Each row consists of::
+      [str(type), minimum, maximum, and mean number of objects,
+       minimum, maximum, and mean total size].
+
+    A type missing in one of the merged summaries is accounted as having no
+    objects in it.
+
+    Like stored summaries (see _SummaryStore), entries are kept in packed
+    form in a few arrays and unpacked when they are accessed. The number of
+    objects used by the history does not depend on the number of entries.
+
+    """
+    # number of values per row of an entry or an entry being merged
+    _ROW = 7
+
+    def __init__(self, archives=((0, 60), (60, 1440), (3600, 720))):
+        """Constructor.
+
+        The default keeps the last 60 summaries, 1-minute entries for one
+        day, and 1-hour entries for 30 days. With a summary per minute,
+        that is full resolution for the last hour.
+
+        Keyword arguments:
+        archives -- list of (step in seconds, number of entries) tuples. A
+                    step of 0 means that every summary is kept.
+        """
+        self.archives = []
+        for (step, rows) in archives:
+            if rows < 1:
+                raise ValueError("archives must keep at least one entry")
+            self.archives.append(step)
+        self._sizes = [rows for (step, rows) in archives]
+        # null-terminated type representations of all archives
+        self._types = ''
+        # number of type representations after they were last pruned
+        self._pruned = 1
+        # start time and number of summaries of the entries of each archive,
+        # oldest first
+        self._times = [array.array('d') for step in self.archives]
+        self._counts = [array.array('l') for step in self.archives]
+        # (type index, min count, max count, mean count, min size, max size,
+        # mean size) of all rows of each archive
+        self._rows = [array.array('d') for step in self.archives]
+        # index in the rows at which each entry starts, with a last entry
+        # marking the end
+        self._offsets = [array.array('l', [0]) for step in self.archives]
+        # start time and number of summaries of the entry currently merged
+        # in each archive, no entry is merged if the number is 0
+        self._current_times = array.array('d', [0.0]) * len(self.archives)
+        self._current_counts = array.array('l', [0]) * len(self.archives)
+        # (min count, max count, sum of counts, min size, max size, sum of
+        # sizes, number of summaries including the type) of each type
+        # index, for the entry currently merged in each archive
+        self._current_rows = [array.array('d') for step in self.archives]
+
+    def _get_objects(self):
+        """Get all objects used by the history itself."""
+        res = [self, self.__dict__, self.archives, self._sizes, self._types,\
+               self._times, self._counts, self._rows, self._offsets,\
+               self._current_times, self._current_counts, self._current_rows]
+        for arrays in (self._times, self._counts, self._rows, self._offsets,\
+                       self._current_rows):
+            res.extend(arrays)
+        return res
+
+    def add(self, s, t=None):
+        """Add summary s taken at time t (default: now)."""
+        if t is None:
+            t = time.time()
+        # (type index, number of objects, total size) of each row
+        packed = self._pack(s)
+        for i in range(len(self.archives)):
+            step = self.archives[i]
+            if step == 0:
+                rows = array.array('d')
+                for (j, count, size) in packed:
+                    rows.extend([j, count, count, count, size, size, size])
+                self._append(i, t, 1, rows)
+                continue
+            start = t - (t % step)
+            if self._current_counts[i] and\
+               (self._current_times[i] != start):
+                self._append(i, self._current_times[i],\
+                             self._current_counts[i], self._finish(i))
+                self._current_counts[i] = 0
+            self._merge(i, start, packed)
+        # pruning takes time proportional to all rows, so it is only done
+        # once the number of type representations doubled
+        if self._types.count('\0') > 2 * self._pruned:
+            self._prune()
+
+    def get(self, step=0):
+        """Get all entries of the archive with the given step, oldest first.
+
+        The entry currently merged is included and counts as one of the
+        entries kept.
+
+        """
+        i = self.archives.index(step)
+        types = self._types.split('\0')
+        (times, counts, rows, offsets) = (self._times[i], self._counts[i],\
+                                          self._rows[i], self._offsets[i])
+        res = []
+        for k in range(len(times)):
+            res.append((times[k], counts[k],\
+                        self._unpack(types, rows, offsets[k], offsets[k+1])))
+        if self._current_counts[i]:
+            rows = self._finish(i)
+            res.append((self._current_times[i], self._current_counts[i],\
+                        self._unpack(types, rows, 0, len(rows))))
+        return res[-self._sizes[i]:]
+
+    def _pack(self, s):
+        """Get the (type index, number of objects, total size) triples of
+        the rows of summary s, adding new type representations."""
+        types = self._types.split('\0')[:-1]
+        indices = dict(zip(types, range(len(types))))
+        new_types = []
+        res = []
+        for row in s:
+            if row[0] not in indices:
+                indices[row[0]] = len(indices)
+                new_types.append(row[0] + '\0')
+            res.append((indices[row[0]], row[1], row[2]))
+        self._types += ''.join(new_types)
+        return res
+
+    def _unpack(self, types, rows, start, end):
+        """Get the rows of an entry as lists."""
+        res = []
+        for j in range(start, end, self._ROW):
+            res.append([types[int(rows[j])], int(rows[j+1]), int(rows[j+2]),\
+                        rows[j+3], int(rows[j+4]), int(rows[j+5]), rows[j+6]])
+        return res
+
+    def _merge(self, i, start, packed):
+        """Merge a packed summary into the current entry of archive i."""
+        current = self._current_rows[i]
+        if not self._current_counts[i]:
+            del current[:]
+            self._current_times[i] = start
+        self._current_counts[i] += 1
+        missing = self._types.count('\0') * self._ROW - len(current)
+        if missing > 0:
+            current.extend(array.array('d', [0.0]) * missing)
+        for (j, count, size) in packed:
+            r = j * self._ROW
+            if current[r+6]:
+                current[r] = min(current[r], count)
+                current[r+1] = max(current[r+1], count)
+                current[r+2] += count
+                current[r+3] = min(current[r+3], size)
+                current[r+4] = max(current[r+4], size)
+                current[r+5] += size
+                current[r+6] += 1
+            else:
+                current[r:r+7] = array.array('d', [count, count, count,\
+                                                   size, size, size, 1])
+
+    def _finish(self, i):
+        """Get the packed rows of the current entry of archive i."""
+        current = self._current_rows[i]
+        n = self._current_counts[i]
+        res = array.array('d')
+        for r in range(0, len(current), self._ROW):
+            if not current[r+6]:
+                continue
+            (cmin, smin) = (current[r], current[r+3])
+            if current[r+6] < n:
+                # missing in some summaries
+                (cmin, smin) = (min(cmin, 0), min(smin, 0))
+            res.extend([r / self._ROW, cmin, current[r+1],\
+                        current[r+2] / n, smin, current[r+4],\
+                        current[r+5] / n])
+        return res
+
+    def _append(self, i, t, n, rows):
+        """Append an entry to archive i, dropping the oldest if it is full."""
+        self._times[i].append(t)
+        self._counts[i].append(n)
+        self._rows[i].extend(rows)
+        offsets = self._offsets[i]
+        offsets.append(len(self._rows[i]))
+        if len(self._times[i]) > self._sizes[i]:
+            end = offsets[1]
+            del self._rows[i][:end]
+            del offsets[0]
+            for k in range(len(offsets)):
+                offsets[k] -= end
+            del self._times[i][0]
+            del self._counts[i][0]
+
+    def _prune(self):
+        """Drop type representations which are no longer used."""
+        types = self._types.split('\0')[:-1]
+        used = set()
+        for rows in self._rows:
+            used.update(rows[0::self._ROW])
+        for i in range(len(self.archives)):
+            current = self._current_rows[i]
+            if self._current_counts[i]:
+                for r in range(0, len(current), self._ROW):
+                    if current[r+6]:
+                        used.add(r / self._ROW)
+        # new index of each type representation still in use
+        indices = array.array('l', [-1]) * len(types)
+        kept = []
+        for j in range(len(types)):
+            if j in used:
+                indices[j] = len(kept)
+                kept.append(types[j] + '\0')
+        for rows in self._rows:
+            for r in range(0, len(rows), self._ROW):
+                rows[r] = indices[int(rows[r])]
+        for i in range(len(self.archives)):
+            current = self._current_rows[i]
+            if not self._current_counts[i]:
+                del current[:]
+                continue
+            compacted = array.array('d')
+            for j in range(len(types)):
+                if indices[j] != -1:
+                    r = j * self._ROW
+                    row = current[r:r+self._ROW]
+                    if len(row) < self._ROW:
+                        # type added after the last merge
+                        row = array.array('d', [0.0]) * self._ROW
+                    compacted.extend(row)
+            current[:] = compacted
+        self._types = ''.join(kept)
+        self._pruned = max(len(kept), 1)
+
         
 class ObjectTracker(object):
     """
@@ -170,46 +899,22 @@ class ObjectTracker(object):
     def _get_objects(self, ignore=[]):
         """Get all currently existing objects.
 
-        XXX - ToDo: This method is a copy&paste from muppy.get_objects, but
-        some modifications are applied. Specifically, it allows to ignore
-        objects (which includes the current frame).
+        Objects are ignored by identity. Besides the objects passed in the
+        ignore list, the tracker itself, its snapshots, and the frames of
+        this module are always ignored.
 
         keyword arguments
         ignore -- list of objects to ignore
         """
-        def remove_ignore(objects, ignore=[]):
-            # remove all objects listed in the ignore list
-            return [o for o in objects if o not in ignore]
-    
-        tmp = gc.get_objects()
-        ignore.append(inspect.currentframe())
-        ignore.append(self)
-        if hasattr(self, 'o0'): ignore.append(self.o0)
-        if hasattr(self, 'o1'): ignore.append(self.o1)
-        ignore.append(ignore)
-        ignore.append(remove_ignore)
-        # this implies that referenced objects are also ignored
-        tmp = remove_ignore(tmp, ignore)
-        import types
-        res = []
-        for o in tmp:
-            # gc.get_objects returns only container objects, but we also want
-            # the objects referenced by them
-            refs = muppy.get_referents(o)
-            for ref in refs:
-                if not muppy._is_containerobject(ref):
-                    # we already got the container objects, now we only add
-                    # non-container objects
-                    res.append(ref)
-        res.extend(tmp)
-        res = muppy._remove_duplicates(res)
-        if ignore is not None:
-            # repeat to filter out objects which may have been referenced
-            res = remove_ignore(res, ignore)
+        ignored = set([id(o) for o in ignore])
+        ignored.update([id(self), id(self.__dict__), id(ignore)])
+        if hasattr(self, 'o0'): ignored.add(id(self.o0))
+        if hasattr(self, 'o1'): ignored.add(id(self.o1))
+        res = muppy._get_snapshot(ignored, [globals()], self, referents=True)
         # manual cleanup, see comment above
         del ignore[:]
         return res
-        
+
     def get_diff(self, ignore=[]):
         """Get the diff to the last time the  state of objects was measured.
 
@@ -219,7 +924,7 @@ class ObjectTracker(object):
         # ignore this and the caller frame
         ignore.append(inspect.currentframe())
         self.o1 = self._get_objects(ignore)
-        diff = muppy.get_diff(self.o0, self.o1)
+        diff = _get_diff(self.o0, self.o1)
         self.o0 = self.o1
         # manual cleanup, see comment above
         del ignore[:]
@@ -240,3 +945,390 @@ class ObjectTracker(object):
         summary.print_(summary.summarize(diff['-']))
         # manual cleanup, see comment above
         del ignore[:]
+
+
+def _get_diff(left, right):
+    """Get the difference of two object lists like muppy.get_diff, but
+    compare the objects by identity instead of equality."""
+    left_ids = set([id(o) for o in left])
+    right_ids = set([id(o) for o in right])
+    return {'+': [o for o in right if id(o) not in left_ids],
+            '-': [o for o in left if id(o) not in right_ids]}
+
+
+def _ignore_ref(ref):
+    """Callback of the weak references of the WeakObjectTracker.
+
+    Weak references without a callback are shared, so the tracker would
+    otherwise use, and ignore, the weak references of the application.
+
+    """
+    pass
+
+
+class WeakObjectTracker(object):
+    """Helper class to track changes in the set of existing objects without
+    keeping them alive.
+
+    Unlike the ObjectTracker, no strong references to tracked objects are
+    stored. Instead, the id, type, and size of each object are recorded in
+    arrays. For objects which support weak references, a weak reference is
+    stored as well.
+
+    Ids of released objects may be reused by new objects. If the type
+    recorded for an id differs, or the weak reference recorded for it no
+    longer refers to the current object, the object is considered new and
+    the old one released. For objects without weak reference support, a
+    reused id of an object of the same type cannot be detected.
+
+    For each object, the number of snapshots it survived is recorded as its
+    age. This allows to tell apart churn, i.e. objects created and released
+    in between two snapshots, from objects which accumulate over time.
+
+    """
+    def __init__(self):
+        """On initialisation, the current state of objects is recorded."""
+        # all types encountered, the type arrays contain indices to this list
+        self._types = []
+        self._type_indices = {}
+        self._ids = array.array('L')
+        self._type_ids = array.array('l')
+        self._sizes = array.array('l')
+        self._refs = []
+        self._ages = array.array('l')
+        (objects, snapshot) = self._take_snapshot()
+        self._set_snapshot(snapshot)
+
+    def _get_own_ids(self):
+        """Get the ids of all objects used by the tracker itself."""
+        res = set([id(self), id(self.__dict__), id(self._types),\
+                   id(self._type_indices), id(self._ids), id(self._type_ids),\
+                   id(self._sizes), id(self._refs), id(self._ages)])
+        for ref in self._refs:
+            if ref is not None:
+                res.add(id(ref))
+        return res
+
+    def _take_snapshot(self):
+        """Take a snapshot of all currently existing objects.
+
+        Return the list of these objects as well as an (ids, type indices,
+        sizes, weak references, ages) tuple. The object list is only needed for
+        comparisons with the previous snapshot and must not be kept.
+
+        """
+        objects = muppy._get_snapshot(self._get_own_ids(), [globals()], self,\
+                                      referents=True)
+        ids = array.array('L')
+        type_ids = array.array('l')
+        sizes = array.array('l')
+        refs = []
+        for o in objects:
+            t = type(o)
+            if t not in self._type_indices:
+                self._type_indices[t] = len(self._types)
+                self._types.append(t)
+            ids.append(id(o))
+            type_ids.append(self._type_indices[t])
+            sizes.append(_getsizeof(o))
+            try:
+                refs.append(weakref.ref(o, _ignore_ref))
+            except TypeError:
+                refs.append(None)
+        ages = array.array('l', [0]) * len(objects)
+        return (objects, (ids, type_ids, sizes, refs, ages))
+
+    def _set_snapshot(self, snapshot):
+        """Replace the recorded snapshot."""
+        (self._ids, self._type_ids, self._sizes, self._refs, self._ages) =\
+                                                                     snapshot
+
+    def _compare(self):
+        """Take a snapshot and compare it with the recorded one.
+
+        Return the objects and the snapshot as returned by _take_snapshot,
+        the indices of all created objects in the new snapshot, and an array
+        which flags the objects of the recorded snapshot which survived. The
+        ages of the new snapshot are set accordingly.
+
+        """
+        (objects, snapshot) = self._take_snapshot()
+        (ids, type_ids, sizes, refs, ages) = snapshot
+        # index of each id in the previous snapshot
+        previous = dict(itertools.izip(self._ids, xrange(len(self._ids))))
+        survived = array.array('b', [0]) * len(self._ids)
+        created = []
+        for i in xrange(len(objects)):
+            j = previous.get(ids[i])
+            if (j is not None) and (self._type_ids[j] == type_ids[i]):
+                ref = self._refs[j]
+                if (ref is None) or (ref() is objects[i]):
+                    survived[j] = 1
+                    ages[i] = self._ages[j] + 1
+                    continue
+            created.append(i)
+        return (objects, snapshot, created, survived)
+
+    def get_diff(self):
+        """Get the diff to the last time the state of objects was measured.
+
+        The result will be a dict with this form {'+': [], '-': []}.
+        Objects listed in '+' were created since, for objects released since
+        an (id, type, size) tuple is listed in '-'.
+
+        """
+        (objects, snapshot, created, survived) = self._compare()
+        res = {'+': [objects[i] for i in created], '-': []}
+        for j in xrange(len(self._ids)):
+            if not survived[j]:
+                res['-'].append((self._ids[j],\
+                                 self._types[self._type_ids[j]],\
+                                 self._sizes[j]))
+        self._set_snapshot(snapshot)
+        return res
+
+    def print_diff(self):
+        """Print the diff to the last time the state of objects was measured.
+        """
+        diff = self.get_diff()
+        print "Added objects:"
+        summary.print_(summary.summarize(diff['+']))
+        print "Removed objects:"
+        rows = {}
+        for (_id, t, size) in diff['-']:
+            otype = summary._repr_type(t)
+            if otype not in rows:
+                rows[otype] = [otype, 0, 0]
+            rows[otype][1] += 1
+            rows[otype][2] += size
+        summary.print_(rows.values())
+
+    def get_churn(self):
+        """Get the number of created, released, and surviving objects per type
+        since the last time the state of objects was measured.
+
+        The result will be a list of [type, created, released, survived]
+        rows. Unlike a summary diff, this reveals objects which are released
+        and replaced by new objects of the same type in between two
+        measurements.
+
+        """
+        (objects, snapshot, created, survived) = self._compare()
+        type_ids = snapshot[1]
+        del objects
+        counts = {}
+        for i in created:
+            counts.setdefault(type_ids[i], [0, 0, 0])[0] += 1
+        for j in xrange(len(self._ids)):
+            row = counts.setdefault(self._type_ids[j], [0, 0, 0])
+            if survived[j]:
+                row[2] += 1
+            else:
+                row[1] += 1
+        self._set_snapshot(snapshot)
+        return [[summary._repr_type(self._types[i])] + row\
+                for (i, row) in counts.iteritems()]
+
+    def get_age_histogram(self):
+        """Get the age histogram of the recorded snapshot.
+
+        The result is a list in which the n-th element is the number of
+        objects which survived n measurements.
+
+        """
+        res = []
+        for age in self._ages:
+            if age >= len(res):
+                res.extend([0] * (age + 1 - len(res)))
+            res[age] += 1
+        return res
+
+    def get_old(self, min_age=1):
+        """Get a summary of all objects of the recorded snapshot which
+        survived at least min_age measurements.
+
+        The result is a list of [type, count, size] rows which can be
+        printed with summary.print_.
+
+        """
+        rows = {}
+        for j in xrange(len(self._ids)):
+            if self._ages[j] >= min_age:
+                otype = summary._repr_type(self._types[self._type_ids[j]])
+                if otype not in rows:
+                    rows[otype] = [otype, 0, 0]
+                rows[otype][1] += 1
+                rows[otype][2] += self._sizes[j]
+        return rows.values()
+
+
+def _init_next(cls, o, *args, **kwargs):
+    """Call the constructor which follows cls in the method resolution order
+    of object o.
+
+    The constructor is looked up when o is created, so constructors of base
+    classes which are tracked afterwards are called as well.
+
+    """
+    mro = inspect.getmro(o.__class__)
+    for base in mro[list(mro).index(cls) + 1:]:
+        if '__init__' in base.__dict__:
+            if base is not object:
+                base.__dict__['__init__'](o, *args, **kwargs)
+            return
+
+
+class ClassTracker(object):
+    """Helper class to track the instances of selected classes.
+
+    The constructor of each tracked class is replaced by one which registers
+    a weak reference to the new instance. Live counts and lifetimes are
+    updated when instances are created and released, so no heap walks are
+    needed. Instances of subclasses are counted as instances of the tracked
+    class. Tracked classes must support weak references.
+
+    Lifetimes are counted in log2 buckets of milliseconds, see
+    summary.get_percentile to compute percentiles from them.
+
+    """
+    def __init__(self, size_interval=None):
+        """Constructor.
+
+        Keyword arguments:
+        size_interval -- if set, the deep size of all live instances is
+                         recomputed with asizeof when statistics are
+                         requested and the last computation is older than
+                         this number of seconds
+        """
+        self.size_interval = size_interval
+        # the original constructor and statistics of each tracked class
+        self._originals = {}
+        self._stats = {}
+        # weak reference callbacks may be invoked while the lock is held
+        self._lock = threading.RLock()
+
+    def track_class(self, cls):
+        """Start tracking instances of cls created from now on."""
+        if cls in self._originals:
+            return
+        if isinstance(cls, type) and not cls.__weakrefoffset__:
+            raise TypeError("%s does not support weak references" % cls)
+        original = self._originals[cls] = cls.__dict__.get('__init__')
+        tracker = self
+        def __init__(self, *args, **kwargs):
+            tracker._register(cls, self)
+            if original is not None:
+                original(self, *args, **kwargs)
+            else:
+                _init_next(cls, self, *args, **kwargs)
+        init = getattr(cls, '__init__', None)
+        if init is not None:
+            __init__.__doc__ = init.__doc__
+        self._stats[cls] = {'live': {},
+                            'created': 0,
+                            'released': 0,
+                            'start': time.time(),
+                            'lifetimes': array.array('l', [0]) *\
+                                         summary.HISTOGRAM_SLOTS,
+                            'size': None,
+                            'size_time': None}
+        cls.__init__ = __init__
+
+    def untrack_class(self, cls):
+        """Stop tracking instances of cls and restore its constructor."""
+        if cls not in self._originals:
+            return
+        original = self._originals.pop(cls)
+        if original is None:
+            del cls.__init__
+        else:
+            cls.__init__ = original
+        self._lock.acquire()
+        try:
+            del self._stats[cls]
+        finally:
+            self._lock.release()
+
+    def _register(self, cls, o):
+        """Register a new instance of a tracked class."""
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(cls)
+            # subclasses may call the constructor of a tracked class twice
+            if (stats is None) or (id(o) in stats['live']):
+                return
+            def release(ref, stats=stats, key=id(o)):
+                self._release(stats, key)
+            stats['live'][id(o)] = (weakref.ref(o, release), time.time())
+            stats['created'] += 1
+        finally:
+            self._lock.release()
+
+    def _release(self, stats, key):
+        """Update the statistics of a released instance."""
+        self._lock.acquire()
+        try:
+            (ref, created) = stats['live'].pop(key)
+            stats['released'] += 1
+            lifetime = int((time.time() - created) * 1000)
+            stats['lifetimes'][frexp(lifetime)[1]] += 1
+        finally:
+            self._lock.release()
+
+    def get_instances(self, cls):
+        """Get a list of all live instances of a tracked class."""
+        self._lock.acquire()
+        try:
+            refs = [ref for (ref, created) in\
+                    self._stats[cls]['live'].values()]
+        finally:
+            self._lock.release()
+        return [o for o in [ref() for ref in refs] if o is not None]
+
+    def sample_sizes(self):
+        """Compute the deep size of all live instances of each tracked class.
+        """
+        for cls in self._stats.keys():
+            size = asizeof.asizeof(*self.get_instances(cls))
+            self._lock.acquire()
+            try:
+                if cls in self._stats:
+                    self._stats[cls]['size'] = size
+                    self._stats[cls]['size_time'] = time.time()
+            finally:
+                self._lock.release()
+
+    def get_stats(self, cls):
+        """Get statistics of a tracked class.
+
+        Return a dictionary with the following entries:
+        live -- number of live instances
+        created -- number of instances created since tracking started
+        released -- number of instances released since tracking started
+        rate -- instances created per second since tracking started
+        lifetimes -- log2 histogram of lifetimes of released instances in
+                     milliseconds
+        size -- deep size of all live instances when last computed, or None
+        size_time -- the time size was computed, or None
+
+        """
+        if self.size_interval is not None:
+            last = self._stats[cls]['size_time']
+            if (last is None) or (time.time() - last > self.size_interval):
+                self.sample_sizes()
+        self._lock.acquire()
+        try:
+            stats = self._stats[cls]
+            elapsed = time.time() - stats['start']
+            rate = 0.0
+            if elapsed > 0:
+                rate = stats['created'] / elapsed
+            return {'live': len(stats['live']),
+                    'created': stats['created'],
+                    'released': stats['released'],
+                    'rate': rate,
+                    'lifetimes': stats['lifetimes'][:],
+                    'size': stats['size'],
+                    'size_time': stats['size_time']}
+        finally:
+            self._lock.release()
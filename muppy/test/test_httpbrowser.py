@@ -0,0 +1,105 @@
+import unittest
+import urllib2
+
+from muppy import httpbrowser
+
+class Foo(object):
+    pass
+
+class HttpBrowserTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        """Check that the snapshot indexes objects and references."""
+        foo = Foo()
+        foo.bar = [Foo(), Foo()]
+        holder = {'foo': foo}
+        snapshot = httpbrowser._Snapshot(roots=[holder])
+        objects = snapshot.objects
+        pfoo = snapshot.get_position(id(foo))
+        pbar = snapshot.get_position(id(foo.bar))
+        self.assert_(pfoo is not None)
+        self.assert_(pbar is not None)
+        # referents are the list items, referrers include the holding dict
+        (referents, total) = snapshot.get_referents(pbar, 0, 10)
+        self.assertEqual(total, 2)
+        self.assertEqual(set([id(objects[p]) for p in referents]),\
+                         set([id(foo.bar[0]), id(foo.bar[1])]))
+        (referrers, total) = snapshot.get_referrers(pfoo, 0, 100)
+        self.assert_(id(holder) in [id(objects[p]) for p in referrers])
+        # paging
+        (referents, total) = snapshot.get_referents(pbar, 1, 10)
+        self.assertEqual(len(referents), 1)
+        (referents, total) = snapshot.get_referents(pbar, 5, 10)
+        self.assertEqual(len(referents), 0)
+        self.assertEqual(total, 2)
+        # objects of a type
+        label = httpbrowser.summary._repr_type(Foo)
+        (positions, total) = snapshot.get_objects(label, 0, 10)
+        self.assertEqual(total, 3)
+        for row in snapshot.summary:
+            if row[0] == label:
+                self.assertEqual(row[1], 3)
+        # path from the root to the leaf
+        (path, reachable) = snapshot.get_path(\
+                                snapshot.get_position(id(foo.bar[1])), 10)
+        self.assert_(reachable)
+        self.assertEqual(id(objects[path[0]]), id(holder))
+        self.assertEqual(id(objects[path[-1]]), id(foo.bar[1]))
+        (path, reachable) = snapshot.get_path(\
+                                snapshot.get_position(id(foo.bar[1])), 2)
+        self.assertEqual(len(path), 2)
+        self.assertEqual(id(objects[path[-1]]), id(foo.bar[1]))
+
+    def test_to_json(self):
+        """Check the JSON encoding of values."""
+        self.assertEqual(httpbrowser._to_json([1, 'a"b', None, True]),\
+                         '[1, "a\\"b", null, true]')
+        self.assertEqual(httpbrowser._to_json({'a': []}), '{"a": []}')
+        self.assertEqual(httpbrowser._to_json([5L, 0.5]), '[5, 0.5]')
+
+    def test_server(self):
+        """Check that the server answers requests with paged JSON."""
+        browser = httpbrowser.HeapBrowser(port=0, page_size=5)
+        browser.start()
+        try:
+            url = 'http://127.0.0.1:%s' % browser.port
+            html = urllib2.urlopen(url + '/').read()
+            self.assert_('<script>' in html)
+            # handlers are not built from strings, which labels could break
+            self.assert_('onclick' not in html)
+            self.assert_('addEventListener' in html)
+            data = urllib2.urlopen(url + '/api/summary?limit=3').read()
+            self.assert_(data.startswith('{'))
+            self.assert_('"limit": 3' in data)
+            foo = browser.snapshot.objects[0]
+            data = urllib2.urlopen(url + '/api/referents?id=%s' % id(foo))
+            self.assert_('"total": ' in data.read())
+            try:
+                urllib2.urlopen(url + '/api/object?id=0')
+                self.fail("HTTPError expected")
+            except urllib2.HTTPError, e:
+                self.assertEqual(e.code, 400)
+            try:
+                urllib2.urlopen(url + '/api/unknown')
+                self.fail("HTTPError expected")
+            except urllib2.HTTPError, e:
+                self.assertEqual(e.code, 404)
+            # requests for other hosts are rejected (DNS rebinding)
+            request = urllib2.Request(url + '/api/summary')
+            request.add_header('Host', 'example.com:%s' % browser.port)
+            try:
+                urllib2.urlopen(request)
+                self.fail("HTTPError expected")
+            except urllib2.HTTPError, e:
+                self.assertEqual(e.code, 403)
+            request = urllib2.Request(url + '/')
+            request.add_header('Host', 'localhost:%s' % browser.port)
+            self.assert_('<script>' in urllib2.urlopen(request).read())
+        finally:
+            browser.stop()
+
+def suite():
+    return unittest.makeSuite(HttpBrowserTest,'test')
+
+if __name__ == '__main__':
+    unittest.TextTestRunner(verbosity=2).run(suite())
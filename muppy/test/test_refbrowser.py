@@ -1,8 +1,12 @@
 import doctest
+import os
+import StringIO
+import tempfile
 import unittest
 import test.test_support
 
 from muppy import refbrowser
+from muppy.muppy import _getsizeof
 
 class TreeTest(unittest.TestCase):
 
@@ -85,6 +89,237 @@ class TreeTest(unittest.TestCase):
         res = refbrowser.RefBrowser(root, str_func=foo, repeat=True).get_tree()
         self.assert_(str(res) == expected)
 
+
+    def test_get_tree_ignore(self):
+        """Check that nodes and the browser itself are ignored by identity,
+        without ignoring dicts which merely look like nodes."""
+        root = 'root id'
+        ref = [root]
+        # used to be mistaken for the dict of a node
+        nodelike = {'o': root, 'children': [], 'str_func': None}
+        self.assert_(not hasattr(refbrowser._Node(root), '__dict__'))
+        browser = refbrowser.RefBrowser(root, maxdepth=1)
+        ignore = set(browser.ignore)
+        res = browser.get_tree()
+        children = [c.o for c in res.children]
+        self.assert_(len([c for c in children if c is ref]) == 1)
+        self.assert_(len([c for c in children if c is nodelike]) == 1)
+        self.assert_(len([c for c in children if c is browser.__dict__]) == 0)
+        # frames and referrer lists are not kept
+        self.assert_(browser.ignore == ignore)
+
+    def test_get_graph(self):
+        """Check that objects found repeatedly share a single node and that
+        the graph is printed like the equivalent tree."""
+        root = 'root id'
+        ref1 = [root]
+        ref2 = [root]
+        shared = [ref1, ref2]
+        res = refbrowser.RefBrowser(root, maxdepth=2).get_tree()
+        nodes = dict([(id(c.o), c) for c in res.children])
+        self.assert_(id(ref1) in nodes)
+        self.assert_(id(ref2) in nodes)
+        children1 = [c for c in nodes[id(ref1)].children if c.o is shared]
+        children2 = [c for c in nodes[id(ref2)].children if c.o is shared]
+        self.assert_(len(children1) == 1)
+        self.assert_(children1[0] is children2[0])
+        # shared nodes are only expanded to maxdepth
+        self.assert_(len(children1[0].children) == 0)
+
+    def test_get_tree_fanout(self):
+        """Check that referrers beyond the fanout are aggregated and that
+        exceeded budgets are reported."""
+        root = 'root id'
+        refs = [[root] for i in range(30)]
+        def label(o): return type(o).__name__
+        for repeat in [True, False]:
+            for sample in [True, False]:
+                browser = refbrowser.RefBrowser(root, maxdepth=1,\
+                                                str_func=label, repeat=repeat,\
+                                                fanout=5, sample=sample)
+                res = browser.get_tree()
+                nodes = [c for c in res.children\
+                         if isinstance(c, refbrowser._Node)]
+                self.assert_(len(nodes) == 5)
+                lists = len([n for n in nodes if isinstance(n.o, list)])
+                self.assert_('+%s more list' % (30 - lists) in res.children)
+                self.assert_(browser.truncated is None)
+            browser = refbrowser.RefBrowser(root, maxdepth=1, str_func=label,\
+                                            repeat=repeat, max_nodes=11)
+            res = browser.get_tree()
+            self.assert_(browser.truncated == 'max_nodes')
+            nodes = [c for c in res.children if isinstance(c, refbrowser._Node)]
+            self.assert_(len(nodes) == 10)
+            self.assert_(len([c for c in res.children\
+                              if str(c).startswith('+')]) > 0)
+
+    def test_write_tree(self):
+        """Check that trees are written to files, that labels are computed
+        once per node, and that cycles are written up to maxdepth."""
+        calls = []
+        def label(o):
+            calls.append(o)
+            return str(o)
+        root = refbrowser._Node('root', label)
+        shared = refbrowser._Node('shared', label)
+        root.children.extend([shared, shared])
+        shared.children.append(root)
+        out = StringIO.StringIO()
+        browser = refbrowser.ConsoleBrowser(None, maxdepth=3)
+        browser._write(root, out)
+        expected = ["root-+-shared--root-+-shared",
+                    "     |              +-shared",
+                    "     |",
+                    "     +-shared--root-+-shared",
+                    "                    +-shared",
+                    ""]
+        self.assert_(out.getvalue() == '\n'.join(expected))
+        self.assert_(len(calls) == 2)
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            browser = refbrowser.FileBrowser(None, maxdepth=3)
+            browser.print_tree(filename, root)
+            f = open(filename)
+            self.assert_(f.read() == out.getvalue())
+            f.close()
+        finally:
+            os.remove(filename)
+
+    def test_stream_tree(self):
+        """Check that trees are written while they are built, without the
+        frames and lists used to build them, and within the budget."""
+        root = 'stream root id'
+        refs = [[root] for i in range(3)]
+        holder = {'first': refs[0]}
+        def label(o):
+            if type(o).__name__ == 'frame':
+                return 'frame(%s)' % o.f_code.co_name
+            return type(o).__name__
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            for repeat in [True, False]:
+                browser = refbrowser.FileBrowser(root, maxdepth=2,\
+                                                 str_func=label, repeat=repeat)
+                browser.print_tree(filename)
+                f = open(filename)
+                output = f.read()
+                f.close()
+                self.assert_(output.startswith('str-+-'))
+                self.assert_(output.count('+-list') >= 3)
+                self.assert_('-dict' in output)
+                for name in ['print_tree', '_build', '_get_children',\
+                             '_get_referrers', '_write']:
+                    self.assert_('frame(%s)' % name not in output)
+            browser = refbrowser.FileBrowser(root, maxdepth=1, str_func=label,\
+                                             max_nodes=2)
+            browser.print_tree(filename)
+            self.assert_(browser.truncated == 'max_nodes')
+            f = open(filename)
+            self.assert_('more list' in f.read())
+            f.close()
+        finally:
+            os.remove(filename)
+
+    def test_stream_graph_lookups(self):
+        """Check that the referrers of objects found repeatedly are looked
+        up only once when a graph is printed."""
+        root = 'shared root id'
+        level1 = [[root] for i in range(4)]
+        level2 = [list(level1) for i in range(4)]
+        lookups = []
+        out = StringIO.StringIO()
+        browser = refbrowser.ConsoleBrowser(root, maxdepth=3)
+        get_referrers = browser._get_referrers
+        def count(o):
+            lookups.append(id(o))
+            return get_referrers(o)
+        browser._get_referrers = count
+        browser._write(None, out)
+        self.assert_(len(lookups) == len(set(lookups)))
+        self.assert_(out.getvalue().count('list') > len(lookups))
+        del lookups[:]
+        browser.get_tree()
+        self.assert_(len(lookups) == len(set(lookups)))
+
+    def test_export(self):
+        """Check that graphs are exported once per object, with edges from
+        referrers to the objects they refer to."""
+        root = refbrowser._Node('root')
+        shared = refbrowser._Node(['shared'])
+        root.children.extend([shared, '+42 more "dict"'])
+        other = refbrowser._Node({})
+        shared.children.extend([root, other])
+        other.children.append(shared)
+        browser = refbrowser.GraphBrowser(None)
+        out = StringIO.StringIO()
+        browser.write_dot(out, root, deep=True)
+        dot = out.getvalue()
+        self.assert_(dot.startswith('digraph referrers {'))
+        self.assert_(dot.count('n%s [' % id(shared.o)) == 1)
+        self.assert_('n%s -> n%s;' % (id(shared.o), id(root.o)) in dot)
+        self.assert_('n%s -> n%s;' % (id(other.o), id(shared.o)) in dot)
+        self.assert_('+42 more \\"dict\\"' in dot)
+        out = StringIO.StringIO()
+        browser.write_json(out, root)
+        # JSON is a subset of Python literals apart from null, true, false
+        nodes = eval(out.getvalue(), {'null': None})['nodes']
+        # characters beyond the BMP are escaped as surrogate pairs
+        self.assert_(refbrowser._json_escape(u'\U0001f600 \xe9') ==\
+                     '"\\ud83d\\ude00 \\u00e9"')
+        self.assert_(len(nodes) == 3)
+        nodes = dict([(n['id'], n) for n in nodes])
+        self.assert_(nodes[id(root.o)]['notes'] == ['+42 more "dict"'])
+        self.assert_(nodes[id(root.o)]['referrers'] == [id(shared.o)])
+        self.assert_(nodes[id(shared.o)]['size'] == _getsizeof(shared.o))
+        self.assert_(nodes[id(other.o)]['deep_size'] is None)
+
+    def test_referent_browser(self):
+        """Check that referents are sorted by deep size, limited to the top
+        ones, and sized only once."""
+        big = 'x' * 10000
+        shared = range(100)
+        cache = {'big': big, 'small': [1], 'shared': [shared, shared]}
+        browser = refbrowser.ReferentBrowser(cache, maxdepth=2, top=2)
+        root = browser.get_root()
+        self.assert_(root.deep_size >= root.size + len(big))
+        self.assert_(not root.expanded)
+        children = browser.expand(root)
+        self.assert_(root.expanded)
+        self.assert_(browser.expand(root) is children)
+        self.assert_(children[0].o is big)
+        self.assert_(children[0].size == _getsizeof(big))
+        self.assert_(children[1].o is cache['shared'])
+        self.assert_(children[0].deep_size >= children[1].deep_size)
+        self.assert_(children[2].startswith('+4 more'))
+        tree = browser.get_tree()
+        self.assert_(tree is root)
+        shared_children = [c for c in children[1].children\
+                           if isinstance(c, refbrowser._Node)]
+        self.assert_(len(shared_children) == 1)
+        self.assert_(shared_children[0].o is shared)
+        out = StringIO.StringIO()
+        browser.print_tree(out)
+        self.assert_(out.getvalue().startswith(str(root)))
+
+    def test_referrer_index(self):
+        """Check that referrers are looked up in the index, once each."""
+        root = 'root id'
+        ref1 = [root, root]
+        ref2 = [root]
+        index = refbrowser._ReferrerIndex()
+        ref3 = [root]
+        referrers = index.get_referrers(root)
+        self.assert_(len([r for r in referrers if r is ref1]) == 1)
+        self.assert_(len([r for r in referrers if r is ref2]) == 1)
+        # objects created later are not indexed
+        self.assert_(len([r for r in referrers if r is ref3]) == 0)
+        self.assert_(len([r for r in referrers if r is index]) == 0)
+        browser = refbrowser.RefBrowser(root, maxdepth=1, index=index)
+        children = [c.o for c in browser.get_tree().children]
+        self.assert_(len([c for c in children if c is ref2]) == 1)
+        self.assert_(len([c for c in children if c is ref3]) == 0)
         
 test_print_tree = """
 
@@ -1,4 +1,6 @@
 import doctest
+import gc
+import StringIO
 import unittest
 
 import muppy
@@ -30,6 +32,206 @@ class SummaryTest(unittest.TestCase):
         for row_e in res:
             self.assert_(row_e in expected)
 
+    def test_histograms(self):
+        """Check that size histograms are kept per row on request and that
+        percentiles are computed as bucket upper bounds.
+
+        """
+        objects = ['a', 'b', 'a'*1000, 1, 2]
+        self.assert_(summary.summarize(objects, histograms=None))
+        histograms = {}
+        res = summary.summarize(objects, histograms=histograms)
+        self.assert_(len(histograms) == len(res))
+        hist = histograms[summary._repr('')]
+        self.assert_(len(hist) == summary.HISTOGRAM_SLOTS)
+        self.assert_(sum(hist) == 3)
+        (p50, p99, max) = summary.get_histogram_stats(hist)
+        self.assert_(_getsizeof('a') <= p50 < 2*_getsizeof('a'))
+        self.assert_(_getsizeof('a'*1000) <= p99 < 2*_getsizeof('a'*1000))
+        self.assert_(p99 == max)
+        hist = histograms[summary._repr(1)]
+        self.assert_(sum(hist) == 2)
+        # some handmade histograms
+        hist = [0] * summary.HISTOGRAM_SLOTS
+        self.assert_(summary.get_histogram_stats(hist) == (0, 0, 0))
+        hist[3] = 99
+        hist[10] = 1
+        self.assert_(summary.get_percentile(hist, 50) == 7)
+        self.assert_(summary.get_percentile(hist, 99) == 7)
+        self.assert_(summary.get_percentile(hist, 100) == 1023)
+
+    def test_summarize_bounded(self):
+        """Check that max_rows limits the number of rows, that frequent types
+        are exact, and that errors are bounds for rare types.
+
+        """
+        objects = ['a'] * 50 + [1] * 30 + [[], {}, (), 1.0, 2L, u'a']
+        errors = {}
+        res = summary.summarize(objects, max_rows=3, errors=errors)
+        self.assert_(len(res) == 3)
+        self.assert_(len(errors) == 3)
+        self.assert_([summary._repr(''), 50, 50*_getsizeof('a')] in res)
+        self.assert_([summary._repr(1), 30, 30*_getsizeof(1)] in res)
+        self.assert_(errors[summary._repr('')] == (0, 0))
+        self.assert_(errors[summary._repr(1)] == (0, 0))
+        # no objects are lost
+        self.assert_(sum([row[1] for row in res]) == len(objects))
+        # the rows are upper bounds, and lower bounds when reduced by the
+        # error
+        exact = {}
+        for row in summary.summarize(objects):
+            exact[row[0]] = row
+        for row in res:
+            (count_error, size_error) = errors[row[0]]
+            self.assert_(row[1] - count_error <= exact[row[0]][1] <= row[1])
+            self.assert_(row[2] - size_error <= exact[row[0]][2] <= row[2])
+        # enough rows give the exact summary
+        errors = {}
+        res = summary.summarize(objects, max_rows=100, errors=errors)
+        self.assert_(sorted(res) == sorted(summary.summarize(objects)))
+        for row in res:
+            self.assert_(errors[row[0]] == (0, 0))
+        self.assertRaises(ValueError, summary.summarize, objects, max_rows=0)
+
+    def test_summarize_two_phase(self):
+        """Check that a two-phase summary sizes only the requested types and
+        estimates the size of all others.
+
+        """
+        objects = ['a', 'b', 'c', 'a'*100, 1, 2, [], [1, 2, 3]]
+        exact = {}
+        for row in summary.summarize(objects):
+            exact[row[0]] = row
+        estimated = set()
+        res = summary.summarize(objects, size_top=1, estimated=estimated)
+        self.assert_(len(res) == len(exact))
+        self.assert_(exact[summary._repr('')] in res)
+        self.assert_(estimated == set([summary._repr(1), summary._repr([])]))
+        for row in res:
+            self.assert_(row[1] == exact[row[0]][1])
+        # sized rows remember their mean size for later estimates
+        estimated = set()
+        res = summary.summarize(objects, size_types=[int, list],
+                                estimated=estimated)
+        self.assert_(estimated == set([summary._repr('')]))
+        self.assert_(exact[summary._repr(1)] in res)
+        self.assert_(exact[summary._repr([])] in res)
+        self.assert_(exact[summary._repr('')] in res)
+        self.assertRaises(ValueError, summary.summarize, objects, size_top=1,
+                          max_rows=1)
+
+    def test_summarize_owners(self):
+        """Check that namespace dictionaries are accounted to their owners
+        and that attributes are only included on request.
+
+        """
+        class Foo(object):
+            def __init__(self):
+                self.items = []
+        class Bar:
+            pass
+        foo = Foo()
+        bar = Bar()
+        objects = [foo, foo.__dict__, foo.items, bar, bar.__dict__, {}, Foo,
+                   unittest]
+        objects.extend(gc.get_referents(Foo))
+        objects.append(unittest.__dict__)
+        foo_label = "dict (owned by %s.Foo)" % __name__
+        res = summary.summarize(objects, owners=True)
+        labels = [row[0] for row in res]
+        self.assert_(foo_label in labels)
+        self.assert_("dict (owned by %s.Bar)" % __name__ in labels)
+        self.assert_("dict (owned by class)" in labels)
+        self.assert_("dict (owned by module)" in labels)
+        self.assert_([summary._repr({}), 1, _getsizeof({})] in res)
+        self.assert_([summary._repr([]), 1, _getsizeof([])] in res)
+        # lists referenced by a namespace
+        res = summary.summarize(objects, owners=True, owner_attributes=True)
+        self.assert_(["list (owned by %s.Foo)" % __name__, 1,
+                      _getsizeof(foo.items)] in res)
+        # the other summaries support owners as well
+        res = summary.summarize(objects, owners=True, max_rows=100)
+        self.assert_(foo_label in [row[0] for row in res])
+        res = summary.summarize(objects, owners=True, size_top=1)
+        self.assert_(foo_label in [row[0] for row in res])
+        # only the namespace is owned, not the values of a dict subclass
+        class Cache(dict):
+            __slots__ = ['stats']
+        cache = Cache(a={})
+        cache.stats = []
+        class Baz(object):
+            def __getattr__(self, name):
+                return {}
+        objects = [cache, cache['a'], cache.stats, Baz()]
+        res = summary.summarize(objects, owners=True, owner_attributes=True)
+        self.assert_([summary._repr({}), 1, _getsizeof({})] in res)
+        self.assert_(["list (owned by %s.Cache)" % __name__, 1,
+                      _getsizeof(cache.stats)] in res)
+
+    def test_rollup(self):
+        """Check that objects are grouped by the module defining their type
+        and that package totals and summaries are computed correctly.
+
+        """
+        class Foo(object): pass
+        class Bar: pass
+        objects = [1, 'a', 'b', Foo(), Foo(), Bar()]
+        rolled = summary.rollup(objects)
+        self.assert_('__builtin__' in rolled)
+        self.assert_(__name__ in rolled)
+        builtins = rolled['__builtin__']
+        self.assert_([summary._repr(''), 2, 2*_getsizeof('a')] in builtins)
+        self.assert_([summary._repr(1), 1, _getsizeof(1)] in builtins)
+        own = rolled[__name__]
+        self.assert_(len(own) == 2)
+        self.assert_([summary._repr(Foo()), 2, 2*_getsizeof(Foo())] in own)
+        # package totals sum up all rows of a package
+        rolled = {'ourapp.cache': [['dict', 2, 100], ['list', 1, 10]],
+                  'ourapp.db': [['dict', 1, 50]],
+                  'ourapplication': [['dict', 1, 1]]}
+        totals = summary.get_package_totals(rolled)
+        self.assert_(['ourapp', 4, 160] in totals)
+        self.assert_(['ourapplication', 1, 1] in totals)
+        # drill down into a package
+        totals = summary.get_package_totals(rolled, level=2, package='ourapp')
+        self.assert_(len(totals) == 2)
+        self.assert_(['ourapp.cache', 3, 110] in totals)
+        self.assert_(['ourapp.db', 1, 50] in totals)
+        rows = summary.get_package_summary(rolled, 'ourapp')
+        self.assert_(len(rows) == 2)
+        self.assert_(['dict', 3, 150] in rows)
+        self.assert_(['list', 1, 10] in rows)
+
+    def test_type_graph(self):
+        """Check that references are counted and sized per pair of types,
+        and that the type graph can be ranked and exported."""
+        t1 = (1, 2)
+        t2 = ('a', 'b', 'c')
+        objects = [[t1, t2, t2], {'x': t1}]
+        rows = summary.get_type_graph(objects)
+        rows = dict([((r[0], r[1]), r) for r in rows])
+        tuple_ = summary._repr(t1)
+        self.assert_(rows[(summary._repr([]), tuple_)][2:] ==\
+                     [3, _getsizeof(t1) + 2*_getsizeof(t2)])
+        self.assert_(rows[(summary._repr({}), tuple_)][2:] ==\
+                     [1, _getsizeof(t1)])
+        self.assert_(rows[(summary._repr({}), summary._repr('x'))][2] == 1)
+        # rank references to a target type
+        ranked = summary._rank_type_graph(rows.values(), 2, tuple_)
+        self.assert_([r[0] for r in ranked] ==\
+                     [summary._repr([]), summary._repr({})])
+        out = StringIO.StringIO()
+        summary.write_type_graph(rows.values(), out, limit=1, sort='#')
+        dot = out.getvalue()
+        self.assert_(dot.startswith('digraph types {'))
+        self.assert_('"%s" -> "%s" [label="3 refs, ' %\
+                     (summary._repr([]), tuple_) in dot)
+        self.assert_(dot.count('->') == 1)
+        out = StringIO.StringIO()
+        summary.write_type_graph([['a\n"b"', 'c', 1, 1]], out)
+        self.assert_('"a\\n\\"b\\"" -> "c"' in out.getvalue())
+        self.assertRaises(ValueError, summary.print_type_graph, [], sort='x')
+
     def test_summary_diff(self):
         left = [[str(str), 3, 3*_getsizeof('a')],\
                 [str(int), 2, 2*_getsizeof(1)],\
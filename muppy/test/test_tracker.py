@@ -1,9 +1,15 @@
 import gc
+import StringIO
 import sys
+import time
+import types
 import unittest
+import weakref
 
 from muppy import summary
 from muppy import tracker
+from muppy.muppy import _getsizeof
+
 
 # used to create an indicattor object to track changes between snapshots
 import bz2
@@ -116,6 +122,265 @@ class TrackerTest(unittest.TestCase):
         s = stracker.summaries[key]
         self.assert_(self._contains_indicator(s) == 1)
 
+    def test_stracker_ignore_stored(self):
+        """Check that stored summaries are not included in new summaries."""
+        stracker = tracker.SummaryTracker()
+        sn = stracker.create_summary()
+        for i in range(10):
+            stracker.store_summary(i)
+        sn2 = stracker.create_summary()
+        # only sn itself is new, the stored summaries are ignored
+        for row in summary.get_diff(sn, sn2):
+            if row[0] == summary._repr([]):
+                self.assert_(row[1] <= len(sn) + 10)
+        self.assert_(id(stracker.summaries) in stracker._get_owned_ids())
+
+    def test_summary_store(self):
+        """Check that summaries are stored and restored correctly."""
+        store = tracker._SummaryStore()
+        s1 = [['str', 3, 120], ['dict', 1, 280]]
+        s2 = [['dict', 2, 560], ['list', 10, 720], ['int', -1, -24]]
+        store['a'] = s1
+        store[2] = s2
+        self.assert_(len(store) == 2)
+        self.assert_('a' in store)
+        self.assert_(store.keys() == ['a', 2])
+        self.assert_(store['a'] == s1)
+        self.assert_(store[2] == s2)
+        self.assert_(store.items() == [('a', s1), (2, s2)])
+        # type representations are only stored once
+        self.assert_(store._types.count('dict') == 1)
+        # replace a summary
+        store['a'] = s2
+        self.assert_(store.keys() == [2, 'a'])
+        self.assert_(store['a'] == s2)
+        del store[2]
+        self.assert_(store.values() == [s2])
+        self.assertRaises(KeyError, store.__getitem__, 2)
+        # the mapping interface of the former summaries dict is supported
+        self.assert_(store.get(2) is None)
+        self.assert_(list(store.iteritems()) == [('a', s2)])
+        self.assert_(list(store.itervalues()) == [s2])
+        self.assert_(list(store.iterkeys()) == ['a'])
+        # representations only used by deleted summaries are dropped
+        self.assert_('str' not in store._types)
+        self.assert_(store['a'] == s2)
+        # no matter how many summaries are stored, the number of objects
+        # used by the store stays the same
+        n = len(store._get_objects())
+        for i in range(10):
+            store[i] = s1
+        self.assert_(len(store._get_objects()) == n)
+
+    def test_btracker_samples(self):
+        """Check that only the most recent samples are kept and that diffs
+        and trends between them are computed correctly.
+
+        """
+        btracker = tracker.BackgroundTracker(size=3)
+        # no baseline summary is taken for the background tracker
+        self.assert_(btracker._tracker.s0 == [])
+        self.assert_(btracker.latest() is None)
+        self.assertRaises(IndexError, btracker.get, 0)
+        btracker.sample()
+        self.assert_(btracker.trend() == [])
+        keep = []
+        for i in range(4):
+            time.sleep(0.01)
+            keep.append(self._get_indicator())
+            btracker.sample()
+        self.assert_(len(btracker) == 3)
+        self.assert_(self._contains_indicator(btracker.latest()) == 4)
+        self.assert_(self._contains_indicator(btracker.get(0)[1]) == 2)
+        self.assert_(btracker.get(0)[0] < btracker.get(-1)[0])
+        samples = btracker._get_samples()
+        self.assert_([t for (t, s) in samples] ==\
+                     [btracker.get(i)[0] for i in range(3)])
+        self.assert_(self._contains_indicator(btracker.diff()) == 1)
+        self.assert_(self._contains_indicator(btracker.diff(0, 2)) == 2)
+        for row in btracker.trend():
+            if row[0].find('bz2.BZ2Compressor') != -1:
+                self.assert_(row[1] > 0)
+                break
+        else:
+            self.fail("no trend for indicator objects")
+        self.assertRaises(ValueError, tracker.BackgroundTracker, size=0)
+
+    def test_btracker_budget(self):
+        """Check that the interval is adapted to the overhead budget and that
+        the overhead is reported.
+
+        """
+        btracker = tracker.BackgroundTracker(interval=60, budget=0.01,
+                                             min_interval=5)
+        # within budget, the configured interval is used
+        btracker._adapt(0.1, False)
+        self.assert_(btracker.current_interval == 60)
+        # back off under load
+        btracker._adapt(1.0, False)
+        self.assert_(abs(btracker.current_interval - 99) < 1e-6)
+        # sample as fast as the budget allows while objects grow
+        btracker._adapt(0.1, True)
+        self.assert_(abs(btracker.current_interval - 9.9) < 1e-6)
+        btracker._adapt(0.01, True)
+        self.assert_(btracker.current_interval == 5)
+        # and slowly return to the configured interval
+        btracker._adapt(0.01, False)
+        self.assert_(btracker.current_interval == 10)
+        # overhead metrics
+        btracker.sample()
+        overhead = btracker.get_overhead()
+        self.assert_(overhead['samples'] == 1)
+        self.assert_(overhead['sampling_time'] > 0)
+        self.assert_(overhead['last_duration'] == overhead['sampling_time'])
+        self.assert_(0 < overhead['overhead'] <= 1)
+        self.assert_(overhead['interval'] == btracker.current_interval)
+        self.assertRaises(ValueError, tracker.BackgroundTracker, budget=0)
+
+    def test_btracker_rules(self):
+        """Check that rules fire when their thresholds are exceeded."""
+        class Foo(object): pass
+        fired = []
+        def callback(rule, s):
+            fired.append(rule)
+        growth = tracker.GrowthRule(Foo, callback, objects=50, window=3600)
+        # types whose rows are labeled per object cannot be watched by type
+        class Old: pass
+        self.assertRaises(ValueError, tracker.GrowthRule, Old, callback,\
+                          objects=1)
+        self.assertRaises(ValueError, tracker.GrowthRule, types.FunctionType,\
+                          callback, objects=1)
+        rule = tracker.GrowthRule(dict, callback, objects=1)
+        self.assert_(rule.label == summary._repr({}))
+        total = tracker.TotalSizeRule(0, callback)
+        self.assertRaises(ValueError, tracker.GrowthRule, Foo, callback)
+        btracker = tracker.BackgroundTracker()
+        btracker.add_rule(growth)
+        btracker.add_rule(total)
+        btracker.sample()
+        self.assert_(fired == [total])
+        foos = [Foo() for i in range(30)]
+        btracker.sample()
+        self.assert_(fired == [total])
+        foos.extend([Foo() for i in range(30)])
+        btracker.sample()
+        self.assert_(fired == [total, growth])
+        # the window starts anew after the rule fired
+        foos.extend([Foo() for i in range(30)])
+        btracker.sample()
+        self.assert_(fired == [total, growth])
+        btracker.remove_rule(growth)
+        foos.extend([Foo() for i in range(60)])
+        btracker.sample()
+        self.assert_(fired == [total, growth])
+
+    def test_summary_history(self):
+        """Check that summaries are merged into archives of fixed size."""
+        history = tracker.SummaryHistory(archives=((0, 2), (10, 2)))
+        history.add([['str', 1, 10], ['dict', 2, 200]], 0)
+        history.add([['str', 3, 30]], 5)
+        history.add([['str', 2, 20]], 10)
+        # full resolution only keeps the last two summaries
+        raw = history.get()
+        self.assert_(len(raw) == 2)
+        self.assert_(raw[0] == (5, 1, [['str', 3, 3, 3.0, 30, 30, 30.0]]))
+        self.assert_(raw[1][0] == 10)
+        # the first two summaries are merged
+        merged = history.get(10)
+        self.assert_(len(merged) == 2)
+        (t, n, rows) = merged[0]
+        self.assert_((t, n) == (0, 2))
+        self.assert_(['str', 1, 3, 2.0, 10, 30, 20.0] in rows)
+        # dicts were missing in one summary
+        self.assert_(['dict', 0, 2, 1.0, 0, 200, 100.0] in rows)
+        self.assert_(merged[1] == (10, 1, [['str', 2, 2, 2.0, 20, 20, 20.0]]))
+        # old entries are dropped
+        history.add([['str', 1, 10]], 20)
+        history.add([['str', 1, 10]], 30)
+        merged = history.get(10)
+        self.assert_([t for (t, n, rows) in merged] == [20, 30])
+        self.assertRaises(ValueError, tracker.SummaryHistory, ((0, 0),))
+        # the number of objects used does not depend on the entries kept
+        n = len(history._get_objects())
+        for t in range(40, 100, 5):
+            history.add([['str', 1, 10], ['type%s' % t, 1, 1]], t)
+        self.assert_(len(history._get_objects()) == n)
+        # representations of dropped entries are pruned eventually
+        self.assert_(history._types.count('\0') < 12)
+        self.assert_(history.get()[-1][2] == [['str', 1, 1, 1.0, 10, 10, 10.0],
+                                              ['type95', 1, 1, 1.0, 1, 1, 1.0]])
+        (t, n, rows) = history.get(10)[-1]
+        self.assert_((t, n) == (90, 2))
+        self.assert_(['str', 1, 1, 1.0, 10, 10, 10.0] in rows)
+        self.assert_(['type90', 0, 1, 0.5, 0, 1, 0.5] in rows)
+        self.assert_(['type95', 0, 1, 0.5, 0, 1, 0.5] in rows)
+        # a background tracker adds its summaries to the history, which is
+        # not part of the summaries
+        btracker = tracker.BackgroundTracker(history=history)
+        btracker.sample()
+        self.assert_(history.get()[-1][0] == btracker.get(-1)[0])
+        ignore = btracker._tracker._get_owned_ids()
+        self.assert_(id(history._rows[0]) in ignore)
+
+    def test_btracker_thread(self):
+        """Check that summaries are taken in the background."""
+        btracker = tracker.BackgroundTracker(interval=0.01, size=2)
+        btracker.start()
+        self.assertRaises(RuntimeError, btracker.start)
+        try:
+            timeout = time.time() + 30
+            while (len(btracker) < 2) and (time.time() < timeout):
+                time.sleep(0.01)
+        finally:
+            btracker.stop()
+        self.assert_(len(btracker) == 2)
+        self.assert_(btracker._thread is None)
+
+    def test_btracker_failing_callback(self):
+        """Check that a failing callback neither stops the other rules nor
+        the background thread."""
+        fired = []
+        def fail(rule, s):
+            raise RuntimeError("pager unavailable")
+        def callback(rule, s):
+            fired.append(rule)
+        btracker = tracker.BackgroundTracker(interval=0.01, size=2)
+        btracker.add_rule(tracker.TotalSizeRule(0, fail))
+        btracker.add_rule(tracker.TotalSizeRule(0, callback))
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            btracker.start()
+            try:
+                timeout = time.time() + 30
+                while (len(btracker) < 2) and (time.time() < timeout):
+                    time.sleep(0.01)
+            finally:
+                btracker.stop()
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        # samples were taken after the callback failed
+        self.assert_(len(btracker) == 2)
+        self.assert_(len(fired) == 1)
+        self.assert_('pager unavailable' in output)
+        # the tracker can be started again if its thread died
+        def sample():
+            raise RuntimeError("sample failed")
+        btracker.sample = sample
+        sys.stderr = StringIO.StringIO()
+        try:
+            btracker.start()
+            thread = btracker._thread
+            if thread is not None:
+                thread.join()
+        finally:
+            sys.stderr = stderr
+        self.assert_(btracker._thread is None)
+        del btracker.sample
+        btracker.start()
+        btracker.stop()
+
 #
 # now the tests for the object tracker
 #
@@ -148,9 +413,144 @@ class TrackerTest(unittest.TestCase):
                 found = True
         self.assert_(not found)
 
+    def test_otracker_ignore_identity(self):
+        """Check that objects are ignored by identity and that the tracker
+        does not list its own objects."""
+        class Foo(object):
+            def __eq__(self, other):
+                raise NotImplementedError
+        otracker = tracker.ObjectTracker()
+        foo = Foo()
+        objects = otracker._get_objects(ignore=[foo])
+        self.assert_(len([o for o in objects if o is foo]) == 0)
+        # an equal, but not identical object is not ignored
+        l = []
+        objects = otracker._get_objects(ignore=[[]])
+        self.assert_(len([o for o in objects if o is l]) == 1)
+        otracker.get_diff()
+        diff = otracker.get_diff()
+        self.assert_(len([o for o in diff['+'] if o is otracker.o0]) == 0)
+        self.assert_(len([o for o in diff['-'] if o is otracker.o0]) == 0)
+
+    def test_wotracker_diff(self):
+        """Check that new and removed objects are listed, even if ids are
+        reused, and that objects are not kept alive.
+
+        """
+        class Foo(object): pass
+        wotracker = tracker.WeakObjectTracker()
+        diff = wotracker.get_diff()
+        diff = None
+        # the tracker does not list its own objects
+        diff = wotracker.get_diff()
+        self.assert_(len(diff['+']) == 0)
+        foos = [Foo() for i in range(100)]
+        diff = wotracker.get_diff()
+        self.assert_(len([o for o in diff['+'] if isinstance(o, Foo)]) == 100)
+        # weak references of the application are not the tracker's
+        diff = None
+        foo_ref = weakref.ref(foos[1])
+        diff = wotracker.get_diff()
+        self.assert_(len([o for o in diff['+'] if o is foo_ref]) == 1)
+        foo_ref = None
+        # objects are not kept alive
+        ids = set([id(o) for o in foos])
+        ref = weakref.ref(foos[0])
+        diff = None
+        o = None
+        foos = None
+        self.assert_(ref() is None)
+        # new objects likely reuse ids of the released ones
+        foos = [Foo() for i in range(100)]
+        diff = wotracker.get_diff()
+        self.assert_(len([o for o in diff['+'] if isinstance(o, Foo)]) == 100)
+        removed = [r for r in diff['-'] if r[1] is Foo]
+        self.assert_(len(removed) == 100)
+        self.assert_(set([r[0] for r in removed]) == ids)
+        self.assert_(removed[0][2] == _getsizeof(foos[0]))
+
+    def test_wotracker_churn(self):
+        """Check that created, released, and surviving objects are counted
+        and that ages are recorded."""
+        class Foo(object): pass
+        label = summary._repr_type(Foo)
+        wotracker = tracker.WeakObjectTracker()
+        foos = [Foo() for i in range(10)]
+        wotracker.get_churn()
+        # replace half of the objects
+        foos[5:] = [Foo() for i in range(5)]
+        rows = [r for r in wotracker.get_churn() if r[0] == label]
+        self.assert_(rows == [[label, 5, 5, 5]])
+        wotracker.get_churn()
+        old = [r for r in wotracker.get_old(min_age=2) if r[0] == label]
+        self.assert_(old == [[label, 5, 5 * _getsizeof(foos[0])]])
+        old = [r for r in wotracker.get_old(min_age=1) if r[0] == label]
+        self.assert_(old[0][1] == 10)
+        histogram = wotracker.get_age_histogram()
+        self.assert_(len(histogram) >= 3)
+        self.assert_(histogram[2] >= 5)
+
+    def test_ctracker(self):
+        """Check that instances of tracked classes are counted when created
+        and released, and that constructors are restored."""
+        class Foo(object):
+            def __init__(self, value):
+                self.value = value
+        class Bar(Foo):
+            def __init__(self):
+                Foo.__init__(self, 'bar')
+        class Slotted(object):
+            __slots__ = ['value']
+        original = Foo.__init__
+        ctracker = tracker.ClassTracker()
+        self.assertRaises(TypeError, ctracker.track_class, Slotted)
+        ctracker.track_class(Foo)
+        ctracker.track_class(Bar)
+        foos = [Foo(i) for i in range(10)]
+        bars = [Bar() for i in range(5)]
+        self.assert_(foos[3].value == 3)
+        self.assert_(bars[0].value == 'bar')
+        stats = ctracker.get_stats(Foo)
+        self.assert_(stats['live'] == 15)
+        self.assert_(stats['created'] == 15)
+        self.assert_(stats['rate'] > 0)
+        self.assert_(ctracker.get_stats(Bar)['live'] == 5)
+        del foos[5:]
+        stats = ctracker.get_stats(Foo)
+        self.assert_(stats['live'] == 10)
+        self.assert_(stats['released'] == 5)
+        self.assert_(sum(stats['lifetimes']) == 5)
+        self.assert_(len(ctracker.get_instances(Foo)) == 10)
+        self.assert_(stats['size'] is None)
+        ctracker.sample_sizes()
+        stats = ctracker.get_stats(Bar)
+        self.assert_(stats['size'] >= 5 * _getsizeof(bars[0]))
+        ctracker.untrack_class(Foo)
+        self.assert_(Foo.__init__ == original)
+        Foo(0)
+        self.assertRaises(KeyError, ctracker.get_stats, Foo)
+        # subclasses tracked before their base count for the base as well
+        class Baz(Foo):
+            pass
+        class Old:
+            def __init__(self, value):
+                self.value = value
+        class OldBaz(Old):
+            pass
+        ctracker.track_class(Baz)
+        ctracker.track_class(Foo)
+        ctracker.track_class(OldBaz)
+        ctracker.track_class(Old)
+        baz = Baz(1)
+        old = OldBaz(2)
+        self.assert_((baz.value, old.value) == (1, 2))
+        self.assert_(ctracker.get_stats(Foo)['live'] == 1)
+        self.assert_(ctracker.get_stats(Baz)['live'] == 1)
+        self.assert_(ctracker.get_stats(Old)['live'] == 1)
+        self.assert_(ctracker.get_stats(OldBaz)['live'] == 1)
+
 def suite():
     return unittest.TestLoader().loadTestsFromTestCase(TrackerTest)
 
 if __name__ == '__main__':
     unittest.TextTestRunner(verbosity=2).run(suite())
-